@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/cache.py
+"""
+Small bounded caches, for memoizing pure functions on repeated input.
+"""
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Bounded mapping, discarding the least recently used entry once it
+    holds more than maxsize entries. Counts hits and misses.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Return the value for key, marking it most recently used, or
+        default if it is not cached.
+        """
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        """Empty the cache and reset the statistics."""
+        self._data.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        """Return a dict of hits, misses, size and maxsize."""
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self._data),
+            maxsize=self.maxsize,
+        )
@@ -1,9 +1,27 @@
 # -*- coding: utf-8 -*-
 # src/pp-utils/pp/utils/id_maker.py
 
+import os
+import errno
+import mmap
+import time
+import datetime
+import functools
+import threading
 import uuid
+import zlib
 import base64
+import binascii
 import re
+import struct
+
+from pp.utils.cache import LRUCache
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # No file locking, so a MappedCounterStore is for one process only
+    fcntl = None
 
 # Looking for words, with possible embedded ' and _
 re_split_words = re.compile(r"[\w'_]+")
@@ -14,7 +32,9 @@ re_split_words = re.compile(r"[\w'_]+")
 
 We avoid just using a UUID as being unreadable. However, a sequential
 number requires access to a central server to allocate the next ID,
-giving a single point of failure.
+giving a single point of failure. Processes on one host can instead
+share sequential-ish numbers by leasing blocks of them from a local
+store, see BlockCounter.
 
 The structure of the ID is in three parts, separated by hyphens.
 The supplied prefix could also be made uup of parts, such as
@@ -77,10 +97,10 @@ hihat_stop_words = [
 ]
 stop_words_set = set(hihat_stop_words)
 
-import jellyfish as jf
-
 
 def process_stop_words(text):
+    # jellyfish is slow to import, and only needed here
+    import jellyfish as jf
     result = []
     words = text.split()
     for word in words:
@@ -123,13 +143,20 @@ def hihat(long_name, short_name_length=4,
     Pun warning! symbol --> cymbal --> hihat.
     """
     if not stop_words:
-        stop_words = set(hihat_stop_words)
+        stop_words = stop_words_set
 
     if not known_abbreviations:
         known_abbreviations = hihat_known_abbreviations
 
+    return _abbreviate(long_name.lower(), short_name_length,
+                       stop_words, known_abbreviations)
+
+
+def _abbreviate(lower_name, short_name_length,
+                stop_words, known_abbreviations):
+    """The rules of hihat, for a name already in lower case."""
     vowels = 'aeiou'
-    words_in_name = re_split_words.findall(long_name.lower())
+    words_in_name = re_split_words.findall(lower_name)
     significant_words = [word for word in words_in_name
                          if word not in stop_words]
     # If the abbreviation of the first word is already known, use it
@@ -155,57 +182,445 @@ def hihat(long_name, short_name_length=4,
         chars = chars + ['x'] * short_name_length
         return ''.join(chars)[:short_name_length]
 
+
+class HihatEngine(object):
+    """Reusable hihat, with the stop words and known abbreviations fixed
+    once, and a bounded LRU cache of results keyed on the lower case name.
+    The results are the same as calling hihat with the same arguments.
+
+    e.g.  engine = HihatEngine()
+          engine.hihat_many(["Vodafone", "BMW", "Vodafone"])
+          --> ['voda', 'bmwx', 'voda']
+          engine.cache_info()
+          --> {'hits': 1, 'misses': 2, 'size': 2, 'maxsize': 10000}
+    """
+    def __init__(self, short_name_length=4, stop_words=None,
+                 known_abbreviations=None, cache_size=10000):
+        self.short_name_length = short_name_length
+        self.stop_words = frozenset(stop_words or hihat_stop_words)
+        self.known_abbreviations = dict(known_abbreviations or
+                                        hihat_known_abbreviations)
+        self._cache = LRUCache(cache_size)
+
+    def hihat(self, long_name, short_name_length=None):
+        """Return the short symbol for long_name, see hihat."""
+        if short_name_length is None:
+            short_name_length = self.short_name_length
+        lower_name = long_name.lower()
+        key = (lower_name, short_name_length)
+        abbreviation = self._cache.get(key)
+        if abbreviation is None:
+            abbreviation = _abbreviate(lower_name, short_name_length,
+                                       self.stop_words,
+                                       self.known_abbreviations)
+            self._cache.set(key, abbreviation)
+        return abbreviation
+
+    __call__ = hihat
+
+    def hihat_many(self, long_names, short_name_length=None):
+        """Return a list of the short symbols for long_names."""
+        return [self.hihat(long_name, short_name_length)
+                for long_name in long_names]
+
+    def cache_info(self):
+        """Return a dict of cache hits, misses, size and maxsize."""
+        return self._cache.stats()
+
+    def cache_clear(self):
+        self._cache.clear()
+
 # ------------------------------------------------------------------------
-# Generator-based number persistence for ID generation
+# Counter persistence for ID generation
 # ------------------------------------------------------------------------
 
-def _num_counter(prefix, start_at, name_length, separator):
-    """Use a coroutine for storing state between calls. So if numbers
-    are required, they can be sequential.
+class IdGenerator(object):
+    """Make IDs for one prefix, storing the counter between calls. So if
+    numbers are required, they can be sequential.
+
+    Call the instance (or its send method) with one argument, to get one
+    ID, or use generate_many to get a batch of IDs in one call.
+
+    If a counter store is supplied (see SQLiteCounterStore and
+    MappedCounterStore), the counter is kept in the store, and shared with
+    other processes using it, by leasing blocks of block_size numbers.
+
+    If time_ordered is set, the slugs start with the time they were made,
+    see time_slug, instead of being random UUIDs.
     """
-    counter = start_at
-    name_or_number = yield "Ignore this first result"
-    while True:
+    def __init__(self, prefix, start_at=1, name_length=6, separator='-',
+                 store=None, block_size=1000, time_ordered=False):
+        self.prefix = prefix
+        self.name_length = name_length
+        self.separator = separator
+        self.counter = start_at
+        # The first call uses start_at as is, later calls increment first.
+        self._started = False
+        self.time_ordered = time_ordered
+        self._blocks = None
+        if store is not None:
+            self._blocks = BlockCounter(store, prefix, start_at, block_size)
+
+    def _next_counter(self):
+        if self._blocks is not None:
+            self.counter = self._blocks.next_number()
+        elif self._started:
+            self.counter += 1
+        return self.counter
+
+    def _set_counter(self, number):
+        self.counter = number
+        if self._blocks is not None:
+            self._blocks.skip_to(number)
+
+    def _readable(self, name_or_number):
+        """Return the readable part of the ID, updating the counter."""
         if name_or_number:
             try:
                 # Check for non-zero integer input
-                readable = str(name_or_number + 0).zfill(name_length)
-                counter = name_or_number
+                readable = str(name_or_number + 0).zfill(self.name_length)
+                self._set_counter(name_or_number)
             except TypeError:
-                readable = hihat(name_or_number, name_length)
+                readable = hihat(name_or_number, self.name_length)
         else:
             # Default to using the integer incremented
-            readable = str(counter).zfill(name_length)
-        # yield returns the formatted string,
-        # then receives the name_or_number. See PEP 342.
-        name_or_number = yield "{}{}{}{}{}".format(
-            prefix, separator,
-            readable, separator,
-            uuid_base64(),
+            readable = str(self._next_counter()).zfill(self.name_length)
+        self._started = True
+        return readable
+
+    def _format(self, readable, slug):
+        return "{}{}{}{}{}".format(
+            self.prefix, self.separator,
+            readable, self.separator,
+            slug,
         )
-        if not name_or_number:
-            counter += 1
 
+    def send(self, name_or_number):
+        """Return the next ID, using a name, a number or, if name_or_number
+        is false, the counter for the readable part.
+        """
+        slug = time_slug() if self.time_ordered else uuid_base64()
+        return self._format(self._readable(name_or_number), slug)
+
+    __call__ = send
+
+    def generate_many(self, n, names_or_numbers=None):
+        """Return a list of n IDs, as if send had been called n times.
+
+        names_or_numbers is an optional sequence of n values, as would be
+        passed to send. The random bytes for all the UUIDs are read in one
+        go and the slugs base64 encoded together.
+        """
+        if names_or_numbers is None:
+            names_or_numbers = [0] * n
+        elif len(names_or_numbers) != n:
+            raise ValueError("Expected {} names or numbers, got {}".format(
+                n, len(names_or_numbers)))
+        readables = [self._readable(name_or_number)
+                     for name_or_number in names_or_numbers]
+        if self.time_ordered:
+            slugs = time_slugs(n)
+        else:
+            slugs = _encode_slugs(_uuid4_bytes(n))
+        return [self._format(readable, slug)
+                for readable, slug in zip(readables, slugs)]
+
+
+def id_generator(prefix, start_at=1, name_length=6, separator='-',
+                 store=None, block_size=1000, time_ordered=False):
+    """Return an IdGenerator for the prefix. Calling it, like the send
+    method of a generator, takes one argument and returns one ID.
+    """
+    return IdGenerator(prefix, start_at, name_length, separator,
+                       store, block_size, time_ordered)
+
+# ------------------------------------------------------------------------
+# Counter blocks, shared between processes
+# ------------------------------------------------------------------------
+
+class SQLiteCounterStore(object):
+    """Keep the next free counter number for each prefix in an SQLite file.
+
+    Any number of processes may lease blocks from the same file. The
+    connection is opened for each lease, which keeps the store safe to use
+    across a fork, and the lease is made inside an immediate transaction,
+    which SQLite serialises with a file lock.
+    """
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        connection = self._connect()
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS id_counters "
+                "(prefix TEXT PRIMARY KEY, next_number INTEGER NOT NULL)")
+        finally:
+            connection.close()
+
+    def _connect(self):
+        import sqlite3
+        return sqlite3.connect(self.path, timeout=self.timeout,
+                               isolation_level=None)
 
-def id_generator(prefix, start_at=1, name_length=6, separator='-'):
-    """Wrapper for generator, to get while loop started, throwing
-    away the first result.
-    Return the generator's send method, which must take one argument.
+    def lease(self, prefix, size, start_at=1, at_least=None):
+        """Reserve size numbers for prefix, returning the first of them.
+
+        The store starts the prefix at start_at, the first time it is
+        leased. at_least makes the block start no lower than that number.
+        """
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT next_number FROM id_counters WHERE prefix = ?",
+                (prefix,)).fetchone()
+            first = start_at if row is None else row[0]
+            if at_least is not None:
+                first = max(first, at_least)
+            connection.execute(
+                "INSERT OR REPLACE INTO id_counters (prefix, next_number) "
+                "VALUES (?, ?)", (prefix, first + size))
+            connection.execute("COMMIT")
+        finally:
+            # Closing without a commit rolls the lease back
+            connection.close()
+        return first
+
+
+class BlockCounter(object):
+    """Hand out counter numbers from a block leased from a counter store.
+
+    Numbers come from memory, without locking, until the block runs out,
+    when the next block is leased. Numbers are unique across processes
+    sharing the store, and sequential within a block. Any unused numbers
+    in a block are lost when the process ends.
+    """
+    def __init__(self, store, prefix, start_at=1, block_size=1000):
+        self.store = store
+        self.prefix = prefix
+        self.start_at = start_at
+        self.block_size = block_size
+        self._next = self._end = 0
+        self._at_least = None
+        self._pid = None
+
+    def _lease(self):
+        first = self.store.lease(self.prefix, self.block_size,
+                                 self.start_at, self._at_least)
+        self._next, self._end = first, first + self.block_size
+        self._at_least = None
+        self._pid = os.getpid()
+
+    def next_number(self):
+        """Return the next number from the current block."""
+        # A forked child must not reuse its parent's block
+        if self._next >= self._end or self._pid != os.getpid():
+            self._lease()
+        number = self._next
+        self._next += 1
+        return number
+
+    def skip_to(self, number):
+        """Make the following numbers come after number, which has been
+        used explicitly.
+        """
+        if number < self._next:
+            return
+        if number + 1 < self._end:
+            self._next = number + 1
+        else:
+            # Give up the rest of this block, the next lease starts higher
+            self._end = self._next
+            self._at_least = number + 1
+
+
+class MappedCounterStore(object):
+    """Keep the next free counter number for each prefix in a small
+    memory-mapped state file, so a restarted process carries on where it
+    left off, without scanning existing IDs.
+
+    Used with BlockCounter, the file is written once per leased block,
+    and flushed before any number in the block is handed out. After a
+    crash, at most one block of numbers per process is skipped, and no
+    number is ever reissued.
+
+    Each prefix has a slot holding two copies of its record, each with a
+    sequence number and a CRC. A lease overwrites the older copy, so a
+    write torn by a crash leaves the newer copy intact. Where fcntl is
+    available, leases are locked so processes can share the file.
+
+    File layout: a 16 byte header, then slots of 64 bytes, each a 32 byte
+    NUL-padded prefix and two 16 byte records.
     """
-    counter_gen = _num_counter(prefix, start_at, name_length, separator)
-    ignored_first_result = next(counter_gen)
-    return counter_gen.send
+    MAGIC = b'PPIDCTR1'
+    HEADER = struct.Struct('<8sII')
+    # sequence, next number, CRC
+    RECORD = struct.Struct('<IqI')
+    PREFIX_SIZE = 32
+    SLOT_SIZE = PREFIX_SIZE + 2 * RECORD.size
+
+    def __init__(self, path, slots=64):
+        self.path = path
+        if not os.path.exists(path):
+            self._create(slots)
+        self._file = self._map = None
+        self._pid = None
+        self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _create(self, slots):
+        """Write a new, empty, state file, unless another process gets
+        there first. The file is written in full under a temporary name,
+        then linked into place, so it is never seen part written, and an
+        existing file is never overwritten.
+        """
+        temp_path = '{}.{}.tmp'.format(self.path, uuid.uuid4().hex)
+        flags = (os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                 getattr(os, 'O_BINARY', 0))
+        fd = os.open(temp_path, flags, 0o666)
+        try:
+            with os.fdopen(fd, 'wb') as state_file:
+                state_file.write(self.HEADER.pack(self.MAGIC, slots, 0))
+                state_file.write(b'\0' * (slots * self.SLOT_SIZE))
+                state_file.flush()
+                os.fsync(state_file.fileno())
+            try:
+                os.link(temp_path, self.path)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+        finally:
+            os.remove(temp_path)
+
+    def _open(self):
+        # A forked child has its parent's file and map, which it closes
+        # without affecting the parent
+        self.close()
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, self.slots, _ = self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError("{} is not a counter state file".format(
+                self.path))
+        self._slot_index = {}
+        self._pid = os.getpid()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _slot_offset(self, index):
+        return self.HEADER.size + index * self.SLOT_SIZE
+
+    def _crc(self, prefix_bytes, sequence, number):
+        return zlib.crc32(prefix_bytes + struct.pack('<Iq', sequence,
+                                                     number)) & 0xffffffff
+
+    def _find_slot(self, prefix_bytes):
+        """Return the index of the prefix's slot, allocating a free one if
+        the prefix has none yet.
+        """
+        try:
+            return self._slot_index[prefix_bytes]
+        except KeyError:
+            pass
+        padded = prefix_bytes.ljust(self.PREFIX_SIZE, b'\0')
+        free = None
+        for index in range(self.slots):
+            offset = self._slot_offset(index)
+            stored = self._map[offset:offset + self.PREFIX_SIZE]
+            if stored == padded:
+                self._slot_index[prefix_bytes] = index
+                return index
+            if free is None and stored == b'\0' * self.PREFIX_SIZE:
+                free = index
+        if free is None:
+            raise ValueError("No free slot for {!r} in {}".format(
+                prefix_bytes, self.path))
+        offset = self._slot_offset(free)
+        self._map[offset:offset + self.PREFIX_SIZE] = padded
+        self._slot_index[prefix_bytes] = free
+        return free
+
+    def _read(self, index, prefix_bytes):
+        """Return (sequence, next number) from the newest valid record in
+        the slot, or None for a new slot.
+        """
+        offset = self._slot_offset(index) + self.PREFIX_SIZE
+        newest = None
+        for copy in range(2):
+            sequence, number, crc = self.RECORD.unpack_from(
+                self._map, offset + copy * self.RECORD.size)
+            if sequence and crc == self._crc(prefix_bytes, sequence, number):
+                if newest is None or sequence > newest[0]:
+                    newest = (sequence, number)
+        return newest
+
+    def _write(self, index, prefix_bytes, sequence, number):
+        offset = (self._slot_offset(index) + self.PREFIX_SIZE +
+                  (sequence % 2) * self.RECORD.size)
+        self.RECORD.pack_into(self._map, offset, sequence, number,
+                              self._crc(prefix_bytes, sequence, number))
+        self._map.flush()
+
+    def lease(self, prefix, size, start_at=1, at_least=None):
+        """Reserve size numbers for prefix, returning the first of them.
+
+        The store starts the prefix at start_at, the first time it is
+        leased. at_least makes the block start no lower than that number.
+        """
+        if self._pid != os.getpid():
+            # Locks are shared with the parent's file, so reopen it
+            self._open()
+        prefix_bytes = prefix.encode('utf-8')
+        if len(prefix_bytes) > self.PREFIX_SIZE:
+            raise ValueError("Prefix {!r} is too long".format(prefix))
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            index = self._find_slot(prefix_bytes)
+            current = self._read(index, prefix_bytes)
+            sequence, first = current if current else (0, start_at)
+            if at_least is not None:
+                first = max(first, at_least)
+            self._write(index, prefix_bytes, sequence + 1, first + size)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        return first
 
 # ------------------------------------------------------------------------
 # base64 handling to compress UUID string from 36 to 22 characters
 # ------------------------------------------------------------------------
 
+# base64 alternative characters for "+" and "/"
+SLUG_ALTCHARS = b'$_'
+SLUG_LENGTH = 22
+
+
+def _ascii(data):
+    """Return base64 output as a native string."""
+    if isinstance(data, str):
+        return data
+    return data.decode('ascii')
+
+
 def uuid2slug(uuidstring):
     """Convert 36-char UUID to 22-char base64 string, changing
     "+" to "$" and "/" to "_".
     """
     uuid_bytes = uuid.UUID(uuidstring).bytes
-    return base64.b64encode(uuid_bytes, '$_').rstrip('=\n')
+    return _ascii(base64.b64encode(uuid_bytes, SLUG_ALTCHARS).rstrip(b'=\n'))
 
 
 def slug2uuid(slug):
@@ -221,13 +636,383 @@ def uuid_base64():
     """Generate a UUID, as a 22-char string"""
     return uuid2slug(uuid.uuid4().hex)
 
+
+def _uuid4_bytes(n):
+    """Return n random version 4 UUIDs, as one string of n * 16 bytes."""
+    raw = bytearray(os.urandom(16 * n))
+    for version_at in range(6, 16 * n, 16):
+        raw[version_at] = (raw[version_at] & 0x0f) | 0x40
+        raw[version_at + 2] = (raw[version_at + 2] & 0x3f) | 0x80
+    return bytes(raw)
+
+
+def _encode_slugs(raw):
+    """Convert a string of n * 16 UUID bytes to a list of n slugs, with a
+    single base64 call.
+
+    Each UUID is padded with two zero bytes, to 18 bytes, which encodes to
+    exactly 24 chars without "=" padding. The first 22 of those are the
+    same as the slug of the unpadded UUID.
+    """
+    padded = b''.join(raw[at:at + 16] + b'\0\0'
+                      for at in range(0, len(raw), 16))
+    encoded = _ascii(base64.b64encode(padded, SLUG_ALTCHARS))
+    return [encoded[at:at + SLUG_LENGTH]
+            for at in range(0, len(encoded), 24)]
+
+def _uuid_bytes(value):
+    """Return the 16 bytes of a UUID given as bytes, a uuid.UUID or a
+    string that uuid.UUID accepts.
+    """
+    if isinstance(value, uuid.UUID):
+        return value.bytes
+    if isinstance(value, bytes) and len(value) == 16:
+        return value
+    # Raises ValueError, as uuid2slug does, for an invalid UUID string
+    return uuid.UUID(value).bytes
+
+
+def uuids2slugs(uuids):
+    """Convert many UUIDs to slugs, with a single base64 call.
+
+    uuids is a string of n * 16 bytes, a sequence of UUIDs (16 bytes,
+    uuid.UUID or UUID strings) or a NumPy array: of UUID bytes, as dtype
+    S16 or V16 or uint8 of shape (n, 16), or of UUID strings (dtype U or
+    S), which are checked one by one. Returns a list of slugs, or an S22
+    array for an array. Raises ValueError for an invalid UUID or array.
+    """
+    if hasattr(uuids, 'dtype'):
+        import numpy as np
+        uuids = np.asarray(uuids)
+        if uuids.dtype.kind in 'SV' and uuids.dtype.itemsize == 16:
+            raw = np.ascontiguousarray(uuids).view(np.uint8).reshape(-1, 16)
+        elif (uuids.dtype == np.uint8 and uuids.ndim == 2 and
+              uuids.shape[1] == 16):
+            raw = np.ascontiguousarray(uuids)
+        elif uuids.dtype.kind in 'US':
+            raw = b''.join(_uuid_bytes(_ascii(value))
+                           for value in uuids.ravel().tolist())
+            raw = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 16)
+        else:
+            raise ValueError("Can not read UUIDs from an array of {}".format(
+                uuids.dtype))
+        padded = np.zeros((len(raw), 18), dtype=np.uint8)
+        padded[:, :16] = raw
+        encoded = base64.b64encode(padded.tobytes(), SLUG_ALTCHARS)
+        return np.frombuffer(encoded, dtype=np.uint8).reshape(
+            -1, 24)[:, :SLUG_LENGTH].copy().view('S22').ravel()
+    if isinstance(uuids, (bytes, bytearray)):
+        if len(uuids) % 16:
+            raise ValueError("UUID bytes must be a multiple of 16 long")
+        return _encode_slugs(bytes(uuids))
+    return _encode_slugs(b''.join(_uuid_bytes(value) for value in uuids))
+
+
+def _check_slugs(slugs):
+    """Raise ValueError for the first slug that slug2uuid would reject."""
+    for slug in slugs:
+        if len(slug) != SLUG_LENGTH:
+            raise ValueError("Invalid slug {!r}".format(slug))
+        try:
+            slug2uuid(_ascii(slug))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid slug {!r}".format(slug))
+
+
+def slugs2uuids(slugs):
+    """Convert many slugs to UUIDs, with a single base64 call.
+
+    slugs is a sequence of 22-char slugs, or a NumPy array of dtype S22
+    (or U22). Returns the UUIDs as one string of n * 16 bytes, or an S16
+    array for an array. Raises ValueError for an invalid slug.
+
+    NumPy drops trailing zero bytes when reading single S16 items, so use
+    tobytes() or a uint8 view of the array to get the complete UUIDs.
+    """
+    is_array = hasattr(slugs, 'dtype')
+    if is_array:
+        import numpy as np
+        slugs = np.asarray(slugs)
+        kind = slugs.dtype.kind
+        width = slugs.dtype.itemsize // (4 if kind == 'U' else 1)
+        # The cast would cut longer strings down to 22 chars
+        if slugs.size and (kind not in 'SU' or (
+                width > SLUG_LENGTH and
+                np.char.str_len(slugs).max() > SLUG_LENGTH)):
+            _check_slugs(slugs)
+        try:
+            slugs = slugs.astype('S22')
+        except UnicodeEncodeError:
+            # Only reached for non-ASCII U22 slugs, which are all invalid
+            _check_slugs(slugs)
+            raise
+        if slugs.size and np.char.str_len(slugs).min() != SLUG_LENGTH:
+            _check_slugs(slugs)
+        # Each slug gets "AA" appended, decoding to 18 bytes
+        padded = np.full((slugs.size, 24), ord('A'), dtype=np.uint8)
+        padded[:, :SLUG_LENGTH] = slugs.view(np.uint8).reshape(
+            -1, SLUG_LENGTH)
+        joined = padded.tobytes()
+    else:
+        if any(len(slug) != SLUG_LENGTH for slug in slugs):
+            _check_slugs(slugs)
+        joined = ''.join(_ascii(slug) + 'AA' for slug in slugs)
+    try:
+        decoded = base64.b64decode(joined, SLUG_ALTCHARS, validate=True)
+    except (TypeError, ValueError, binascii.Error):
+        _check_slugs(slugs)
+        raise
+    if is_array:
+        return np.frombuffer(decoded, dtype=np.uint8).reshape(
+            -1, 18)[:, :16].copy().view('S16').ravel()
+    return b''.join(decoded[at:at + 16] for at in range(0, len(decoded), 18))
+
+
+# ------------------------------------------------------------------------
+# Time ordered slugs
+# ------------------------------------------------------------------------
+
+# The slug alphabet, in order of base64 value
+SLUG_ALPHABET = ('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+                 '0123456789$_')
+# Only the first 52 chars of the alphabet are in ASCII order, so the time
+# and sequence are written as base 52 digits with these.
+_ORDERED_DIGITS = SLUG_ALPHABET[:52]
+_TIME_DIGITS = 8
+_SEQUENCE_DIGITS = 2
+_MAX_SEQUENCE = 52 ** _SEQUENCE_DIGITS
+_RANDOM_CHARS = SLUG_LENGTH - _TIME_DIGITS - _SEQUENCE_DIGITS
+# The last char of a slug only holds two bits of the UUID
+_LAST_CHARS = 'AQgw'
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _ordered_digits(number, width):
+    chars = []
+    for _ in range(width):
+        number, digit = divmod(number, 52)
+        chars.append(_ORDERED_DIGITS[digit])
+    return ''.join(reversed(chars))
+
+
+class _TimeSlugClock(object):
+    """Hand out (millisecond, sequence) pairs, which always increase
+    within the process, even if the system clock goes back.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ms = 0
+        self._sequence = 0
+
+    def tick(self, n=1):
+        """Return (millisecond, first sequence number) for n slugs, all in
+        the same millisecond.
+        """
+        if n > _MAX_SEQUENCE:
+            raise ValueError("At most {} time slugs per call".format(
+                _MAX_SEQUENCE))
+        now_ms = int(time.time() * 1000)
+        with self._lock:
+            if now_ms > self._ms:
+                self._ms, self._sequence = now_ms, 0
+            if self._sequence + n > _MAX_SEQUENCE:
+                # Run ahead of the clock, rather than repeat a sequence
+                self._ms, self._sequence = self._ms + 1, 0
+            sequence = self._sequence
+            self._sequence += n
+            return self._ms, sequence
+
+_time_slug_clock = _TimeSlugClock()
+
+
+def time_slugs(n):
+    """Return n slugs, which sort (as strings, or as UUID bytes) in the
+    order they were made.
+
+    Like a ULID, the slug is the time in milliseconds, as 8 chars, a
+    per-process sequence number, as 2 chars, then 12 random chars. The
+    slug is a valid 22-char slug, but the UUID is not an RFC 4122 version.
+    """
+    slugs = []
+    for at in range(0, n, _MAX_SEQUENCE):
+        count = min(n - at, _MAX_SEQUENCE)
+        ms, sequence = _time_slug_clock.tick(count)
+        time_part = _ordered_digits(ms, _TIME_DIGITS)
+        random_bytes = bytearray(os.urandom(count * _RANDOM_CHARS))
+        for index in range(count):
+            randoms = random_bytes[index * _RANDOM_CHARS:
+                                   (index + 1) * _RANDOM_CHARS]
+            slugs.append(''.join([
+                time_part,
+                _ordered_digits(sequence + index, _SEQUENCE_DIGITS),
+                ''.join(SLUG_ALPHABET[b & 63] for b in randoms[:-1]),
+                _LAST_CHARS[randoms[-1] & 3],
+            ]))
+    return slugs
+
+
+def time_slug():
+    """Return one time ordered slug, see time_slugs."""
+    return time_slugs(1)[0]
+
+
+def _datetime_ms(dt):
+    delta = dt - _EPOCH
+    return (delta.days * 86400000 + delta.seconds * 1000 +
+            delta.microseconds // 1000)
+
+
+def slug_time(slug):
+    """Return the UTC datetime, to the millisecond, that a time ordered
+    slug was made.
+    """
+    ms = 0
+    for char in slug[:_TIME_DIGITS]:
+        digit = _ORDERED_DIGITS.find(char)
+        if digit < 0:
+            raise ValueError("Not a time ordered slug {!r}".format(slug))
+        ms = ms * 52 + digit
+    return _EPOCH + datetime.timedelta(milliseconds=ms)
+
+
+def time_slug_floor(dt):
+    """Return the lowest time ordered slug that could be made at the UTC
+    datetime dt. Slugs made from dt up to, but not including, end are
+    those >= time_slug_floor(dt) and < time_slug_floor(end).
+    """
+    return (_ordered_digits(_datetime_ms(dt), _TIME_DIGITS) +
+            'A' * (SLUG_LENGTH - _TIME_DIGITS))
+
+
+# ------------------------------------------------------------------------
+# Parsing IDs
+# ------------------------------------------------------------------------
+
+_HEX_UUID = re.compile(
+    r'[0-9a-fA-F]{8}(-?)[0-9a-fA-F]{4}\1[0-9a-fA-F]{4}\1[0-9a-fA-F]{4}\1'
+    r'[0-9a-fA-F]{12}$')
+
+
+def _uuid_part_bytes(text):
+    """Return the 16 bytes of a slug, or 32 or 36-char UUID, or None."""
+    if len(text) == SLUG_LENGTH:
+        try:
+            uuid_bytes = base64.b64decode(text + '==', SLUG_ALTCHARS)
+        except (TypeError, ValueError, binascii.Error):
+            return None
+        return uuid_bytes if len(uuid_bytes) == 16 else None
+    if _HEX_UUID.match(text):
+        return uuid.UUID(text).bytes
+    return None
+
+
+@functools.total_ordering
+class ParsedId(object):
+    """The parts of an ID: prefix, readable part, counter (if the readable
+    part is a number, otherwise None) and the UUID as 16 bytes.
+
+    IDs compare and sort by (prefix, readable, uuid). pack gives the same
+    order as fixed-width bytes, for compact storage and indexing.
+    """
+    __slots__ = ('prefix', 'readable', 'counter', 'uuid', 'separator')
+
+    def __init__(self, prefix, readable, uuid_bytes, separator='-'):
+        self.prefix = prefix
+        self.readable = readable
+        self.counter = int(readable) if readable.isdigit() else None
+        self.uuid = uuid_bytes
+        self.separator = separator
+
+    @classmethod
+    def parse(cls, some_id, separator='-'):
+        """Parse an ID, made by id_generator, or with a 32 or 36-char UUID
+        in place of the slug. Raises ValueError if it can not be parsed.
+        """
+        # Slugs and dashed UUIDs may contain the separator, so the UUID is
+        # split off by its length. The prefix may contain the separator,
+        # but the readable part can't.
+        for length in (36, 32, SLUG_LENGTH):
+            if (len(some_id) > length and
+                    some_id[-length - 1] == separator):
+                uuid_bytes = _uuid_part_bytes(some_id[-length:])
+                if uuid_bytes is not None:
+                    break
+        else:
+            raise ValueError("Invalid ID {!r}".format(some_id))
+        parts = some_id[:-length - 1].rsplit(separator, 1)
+        if len(parts) != 2 or not parts[0] or not parts[1]:
+            raise ValueError("Invalid ID {!r}".format(some_id))
+        prefix, readable = parts
+        return cls(prefix, readable, uuid_bytes, separator)
+
+    @property
+    def slug(self):
+        return _encode_slugs(self.uuid)[0]
+
+    def __str__(self):
+        return "{}{}{}{}{}".format(
+            self.prefix, self.separator,
+            self.readable, self.separator,
+            self.slug,
+        )
+
+    def __repr__(self):
+        return "<ParsedId {}>".format(self)
+
+    def _key(self):
+        return (self.prefix, self.readable, self.uuid)
+
+    def __eq__(self, other):
+        if not isinstance(other, ParsedId):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __lt__(self, other):
+        if not isinstance(other, ParsedId):
+            return NotImplemented
+        return self._key() < other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def pack(self, prefix_width=16, readable_width=8):
+        """Return the ID as prefix_width + readable_width + 16 bytes. The
+        prefix and readable parts are NUL-padded, so packed IDs sort in
+        the same order as ParsedIds.
+        """
+        prefix = self.prefix.encode('utf-8')
+        readable = self.readable.encode('utf-8')
+        if len(prefix) > prefix_width or len(readable) > readable_width:
+            raise ValueError("{} does not fit in {} + {} bytes".format(
+                self, prefix_width, readable_width))
+        return (prefix.ljust(prefix_width, b'\0') +
+                readable.ljust(readable_width, b'\0') +
+                self.uuid)
+
+    @classmethod
+    def unpack(cls, data, prefix_width=16, readable_width=8, separator='-'):
+        """Return the ParsedId from the bytes made by pack."""
+        split_at = prefix_width + readable_width
+        if len(data) != split_at + 16:
+            raise ValueError("Packed ID must be {} bytes".format(
+                split_at + 16))
+        prefix = data[:prefix_width].rstrip(b'\0').decode('utf-8')
+        readable = data[prefix_width:split_at].rstrip(b'\0').decode('utf-8')
+        return cls(prefix, readable, bytes(data[split_at:]), separator)
+
+
 def get_id_counter(some_id):
-    """Hack to extract id counter number"""
+    """Extract the id counter number, or -1 if the ID has no number."""
     try:
-        return int(some_id.split('-')[2:3][0])
+        counter = ParsedId.parse(some_id).counter
     except ValueError:
-        # Counter is a word, not a string number
         return -1
+    # Counter is a word, not a string number
+    return -1 if counter is None else counter
 
 
 if __name__ == '__main__': #pragma nocover
@@ -236,5 +1021,7 @@ if __name__ == '__main__': #pragma nocover
     id_gen_usr = id_generator('pp-usr', start_at=345)
     for val in [0, 5001, 0, "John Smith", 0, 201, 0, "Vodafone", 0, 0]:
         print("{:>12} --> {}".format(val, id_gen_usr(val)))
+    for generated_id in id_gen_usr.generate_many(3):
+        print("{:>12} --> {}".format('', generated_id))
 
     print("\nFinished.")
\ No newline at end of file
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/id_server.py
+"""
+Asyncio server handing out blocks of IDs over a Unix socket, so services
+in different containers on one host share the same prefix sequences.
+
+The server owns an id_maker.IdGenerator for each prefix, so the IDs are
+the same format as id_generator makes. Clients keep a buffer of IDs and
+fetch the next block in the background once it runs low, so callers
+rarely wait for the server.
+
+The protocol is one JSON object per line, each way:
+
+    {"op": "block", "prefix": "pp-usr", "count": 100,
+     "client": "web-1", "buffered": 12, "capacity": 200}
+    --> {"ids": ["pp-usr-000101-...", ...]}
+
+    {"op": "stats"}
+    --> {"clients": {"web-1": {"prefix": "pp-usr", "buffered": 12, ...}}}
+
+e.g.
+    server = IdBlockServer('/run/ids.sock', start_at=101)
+    await server.start()
+
+    client = IdBlockClient('/run/ids.sock', 'pp-usr', block_size=100)
+    await client.connect()
+    new_id = await client.next_id()
+"""
+import os
+import json
+import socket
+import asyncio
+import logging
+import collections
+
+from pp.utils.id_maker import IdGenerator
+
+
+def get_log():
+    return logging.getLogger('pp.utils.id_server')
+
+
+class IdServerError(Exception):
+    """Raised by the client when the server rejects a request."""
+
+
+class IdBlockServer(object):
+    """Serve blocks of IDs, for any prefix, over a Unix socket.
+
+    Generators for new prefixes are made with start_at, name_length,
+    separator and store (see id_maker.IdGenerator), or may be supplied in
+    generators, a dict of prefix -> IdGenerator.
+    """
+    def __init__(self, path, start_at=1, name_length=6, separator='-',
+                 store=None, generators=None, max_block=10000):
+        self.path = path
+        self.start_at = start_at
+        self.name_length = name_length
+        self.separator = separator
+        self.store = store
+        self.max_block = max_block
+        self.generators = dict(generators or {})
+        # client name -> dict of its last reported buffer use
+        self.client_stats = {}
+        self._server = None
+
+    def generator(self, prefix):
+        try:
+            return self.generators[prefix]
+        except KeyError:
+            generator = self.generators[prefix] = IdGenerator(
+                prefix, self.start_at, self.name_length, self.separator,
+                self.store)
+            return generator
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle,
+                                                       path=self.path)
+        get_log().info("IdBlockServer: listening on '{}'".format(self.path))
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _block(self, request):
+        prefix = request['prefix']
+        count = int(request.get('count', 1))
+        if not 0 < count <= self.max_block:
+            raise ValueError("count must be 1 to {}".format(self.max_block))
+        client = request.get('client')
+        if client is not None:
+            stats = self.client_stats.setdefault(client, dict(
+                prefix=prefix, blocks=0, ids=0))
+            stats.update(
+                buffered=request.get('buffered', 0),
+                capacity=request.get('capacity', 0),
+            )
+            stats['blocks'] += 1
+            stats['ids'] += count
+        return dict(ids=self.generator(prefix).generate_many(count))
+
+    def _respond(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("Request must be a JSON object")
+        op = request.get('op')
+        if op == 'block':
+            return self._block(request)
+        if op == 'stats':
+            return dict(clients=self.client_stats)
+        raise ValueError("Unknown op {!r}".format(op))
+
+    async def _handle(self, reader, writer):
+        log = get_log()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = self._respond(json.loads(line.decode('utf-8')))
+                except (ValueError, KeyError, TypeError) as error:
+                    log.warning("IdBlockServer: bad request {!r}: {}".format(
+                        line, error))
+                    response = dict(error=str(error))
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+class IdBlockClient(object):
+    """Take IDs for one prefix from an IdBlockServer.
+
+    The client asks for block_size IDs at a time, and starts fetching the
+    next block, in the background, when fewer than low_water are left in
+    its buffer. Each request tells the server how full the buffer is.
+    """
+    def __init__(self, path, prefix, block_size=100, low_water=None,
+                 name=None):
+        self.path = path
+        self.prefix = prefix
+        self.block_size = block_size
+        if low_water is None:
+            low_water = block_size // 2
+        self.low_water = low_water
+        self.name = name or "{}-{}".format(socket.gethostname(), os.getpid())
+        self.buffer = collections.deque()
+        # IDs served straight from the buffer, and calls that had to wait
+        self.hits = 0
+        self.waits = 0
+        self.fetches = 0
+        self._reader = self._writer = None
+        self._fetch = None
+        self._lock = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(
+            self.path)
+        # One request at a time on the connection
+        self._lock = asyncio.Lock()
+        self._start_fetch()
+
+    async def close(self):
+        if self._fetch is not None and not self._fetch.done():
+            self._fetch.cancel()
+            try:
+                await self._fetch
+            except asyncio.CancelledError:
+                pass
+        elif self._fetch is not None and not self._fetch.cancelled():
+            # Retrieve any error, which no one will see now
+            self._fetch.exception()
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _request(self, request):
+        async with self._lock:
+            self._writer.write(json.dumps(request).encode('utf-8') + b'\n')
+            await self._writer.drain()
+            line = await self._reader.readline()
+        if not line:
+            raise IdServerError("Connection closed by the server")
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise IdServerError(response['error'])
+        return response
+
+    async def _fetch_block(self):
+        response = await self._request(dict(
+            op='block',
+            prefix=self.prefix,
+            count=self.block_size,
+            client=self.name,
+            buffered=len(self.buffer),
+            capacity=self.block_size + self.low_water,
+        ))
+        self.buffer.extend(response['ids'])
+        self.fetches += 1
+
+    def _failed(self, fetch):
+        return (fetch is not None and fetch.done() and
+                not fetch.cancelled() and fetch.exception() is not None)
+
+    def _raise_fetch_error(self):
+        """Raise the error of a failed fetch, once."""
+        fetch = self._fetch
+        if self._failed(fetch):
+            self._fetch = None
+            raise fetch.exception()
+
+    def _start_fetch(self):
+        # A failed fetch is kept, for next_id to raise its error
+        if self._fetch is None or (self._fetch.done() and
+                                   not self._failed(self._fetch)):
+            self._fetch = asyncio.ensure_future(self._fetch_block())
+
+    async def next_id(self):
+        """Return the next ID, waiting only if the buffer is empty.
+        Raises the error of a failed background fetch.
+        """
+        self._raise_fetch_error()
+        if self.buffer:
+            self.hits += 1
+        else:
+            self.waits += 1
+            while not self.buffer:
+                self._start_fetch()
+                await asyncio.wait({self._fetch})
+                self._raise_fetch_error()
+        new_id = self.buffer.popleft()
+        if len(self.buffer) < self.low_water:
+            self._start_fetch()
+        return new_id
+
+    async def next_ids(self, n):
+        """Return a list of the next n IDs."""
+        return [await self.next_id() for _ in range(n)]
+
+    async def server_stats(self):
+        """Return the server's record of buffer use for all clients."""
+        return (await self._request(dict(op='stats')))['clients']
+
+    def stats(self):
+        """Return a dict of this client's buffer use."""
+        return dict(
+            buffered=len(self.buffer),
+            block_size=self.block_size,
+            low_water=self.low_water,
+            hits=self.hits,
+            waits=self.waits,
+            fetches=self.fetches,
+        )
@@ -5,27 +5,79 @@ Created on May 30, 2013
 
 @author: Edward Easton
 '''
+import re
 import json
+import math
 import datetime
 import logging
+import functools
+import itertools
+import collections
 
-from zope.interface.registry import Components
-from zope.interface import Interface, providedBy
+from json.encoder import encode_basestring_ascii
 
-# Singleton type registry
-_TYPE_REGISTRY = Components()
-_marker = object()
+try:
+    basestring_ = basestring
+except NameError:
+    basestring_ = str
+
+# Singleton type registry, and its marker interface, made on first use by
+# _get_registry, so zope.interface is only imported when needed.
+_registry = None
+_interface = None
+# All (type or interface, adapter) pairs added
+_ADAPTERS = []
+
+# Declared JSON shapes: type -> JSONShape
+_SHAPES = {}
+
+# Cache of type -> function encoding its instances, or None if there is no
+# function. Cleared whenever an adapter is added or removed.
+_DISPATCH_CACHE = {}
+# Cached for types whose instances must be looked up one at a time
+_PER_INSTANCE = object()
 
 
 def get_log():
     return logging.getLogger('pp.utils.json')
 
 
-class IJSONAdapter(Interface):
-    """
-    Marker interface for objects that can convert an arbitrary object
-    into a JSON-serializable primitive.
+def _get_interface():
+    global _interface
+    if _interface is None:
+        from zope.interface import Interface
+
+        class IJSONAdapter(Interface):
+            """
+            Marker interface for objects that can convert an arbitrary
+            object into a JSON-serializable primitive.
+            """
+        _interface = IJSONAdapter
+    return _interface
+
+
+def _get_registry():
+    """ Return the type registry, making it on first use.
     """
+    global _registry
+    if _registry is None:
+        from zope.interface.registry import Components
+        registry = Components()
+        for type_or_iface, adapter in _ADAPTERS:
+            registry.registerAdapter(adapter, (type_or_iface,),
+                                     _get_interface())
+        _registry = registry
+    return _registry
+
+
+def __getattr__(name):
+    # Module attributes made on first use (Python 3.7 and later)
+    if name == 'IJSONAdapter':
+        return _get_interface()
+    if name == '_TYPE_REGISTRY':
+        return _get_registry()
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
 
 
 def get_adapters():
@@ -33,7 +85,8 @@ def get_adapters():
     """
     # XXX this is super-sketchy! Learn to use the API properly ;)
     res = []
-    for i in _TYPE_REGISTRY.adapters._adapters:
+    IJSONAdapter = _get_interface()
+    for i in _get_registry().adapters._adapters:
         for type_ in i:
             res.append((type_.inherit, i[type_][IJSONAdapter]['']))
     return res
@@ -55,8 +108,85 @@ def add_adapter(type_or_iface, adapter):
     >>> json.dumps(Foo(), cls=CustomEncoder)
     5
     """
-    global _TYPE_REGISTRY
-    _TYPE_REGISTRY.registerAdapter(adapter, (type_or_iface,), IJSONAdapter)
+    _ADAPTERS.append((type_or_iface, adapter))
+    if _registry is not None:
+        _registry.registerAdapter(adapter, (type_or_iface,), _get_interface())
+    clear_dispatch_cache()
+
+
+def remove_adapter(type_or_iface):
+    """ Remove the adapter added for a type or interface, returning True,
+        or False if there is none.
+    """
+    kept = [item for item in _ADAPTERS if item[0] is not type_or_iface]
+    if len(kept) == len(_ADAPTERS):
+        return False
+    _ADAPTERS[:] = kept
+    if _registry is not None:
+        _registry.unregisterAdapter(required=(type_or_iface,),
+                                    provided=_get_interface())
+    clear_dispatch_cache()
+    return True
+
+
+def clear_dispatch_cache():
+    """ Forget the adapters looked up for each type. Call this after
+        changing the registry other than through add_adapter.
+    """
+    _DISPATCH_CACHE.clear()
+
+
+def _call_json(obj):
+    return obj.__json__()
+
+
+def _lookup(obj):
+    """ Return the function to encode obj, or None.
+    """
+    shape = _SHAPES.get(type(obj))
+    if shape is not None:
+        return shape.to_json
+    if hasattr(obj, '__json__'):
+        return _call_json
+    from zope.interface import providedBy
+    return _get_registry().adapters.lookup((providedBy(obj),),
+                                           _get_interface(), default=None)
+
+
+def _lookup_type(type_):
+    """ Return the function to encode instances of type_, None if there
+        is none, or _PER_INSTANCE if it depends on the instance.
+    """
+    shape = _SHAPES.get(type_)
+    if shape is not None:
+        return shape.to_json
+    if hasattr(type_, '__getattr__'):
+        # hasattr(obj, '__json__') may differ from instance to instance
+        return _PER_INSTANCE
+    if hasattr(type_, '__json__'):
+        return _call_json
+    from zope.interface import implementedBy
+    return _get_registry().adapters.lookup((implementedBy(type_),),
+                                           _get_interface(), default=None)
+
+
+def _dispatch(obj):
+    """ Return the function to encode obj, or None, using the cache of
+        lookups by type where the instance doesn't change the answer.
+    """
+    type_ = type(obj)
+    try:
+        encode = _DISPATCH_CACHE[type_]
+    except KeyError:
+        encode = _DISPATCH_CACHE[type_] = _lookup_type(type_)
+    if encode is _PER_INSTANCE:
+        return _lookup(obj)
+    # An instance may have its own __json__, or directlyProvides interfaces
+    instance_dict = getattr(obj, '__dict__', None)
+    if instance_dict and ('__json__' in instance_dict or
+                          '__provides__' in instance_dict):
+        return _lookup(obj)
+    return encode
 
 
 # Built-in adapters
@@ -72,15 +202,645 @@ class CustomEncoder(json.JSONEncoder):
         objects.
     """
     def default(self, obj):
-        global __TYPE_REGISTRY
-        if hasattr(obj, '__json__'):
-            return obj.__json__()
-        obj_iface = providedBy(obj)
-        adapter = _TYPE_REGISTRY.adapters.lookup((obj_iface,),
-                                                 IJSONAdapter,
-                                                 default=_marker)
-        if adapter is not _marker:
-            return adapter(obj)
+        encode = _dispatch(obj)
+        if encode is not None:
+            return encode(obj)
 
         # Let the base class default method raise the TypeError
         return json.JSONEncoder.default(self, obj)
+
+
+# ------------------------------------------------------------------------
+# Declared JSON shapes, with generated encoders
+# ------------------------------------------------------------------------
+
+_SHAPE_ENCODER = CustomEncoder()
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def _encode_value(value):
+    """ Encode one value as CustomEncoder does, quicker for simple types.
+    """
+    if value is None:
+        return 'null'
+    type_ = type(value)
+    if type_ is str:
+        return encode_basestring_ascii(value)
+    if type_ is int:
+        return int.__repr__(value)
+    if type_ is bool:
+        return 'true' if value else 'false'
+    return _SHAPE_ENCODER.encode(value)
+
+
+def _shape_encoder(encode):
+    """ Wrap a CustomEncoder encode function, to encode objects with a
+        declared shape directly to text.
+    """
+    shapes = _SHAPES
+
+    def encode_record(record):
+        shape = shapes.get(type(record))
+        if shape is not None:
+            return shape.to_text(record)
+        return encode(record)
+    return encode_record
+
+
+class JSONShape(object):
+    """ The JSON form of a class, declared once: its fields in order, as
+        attribute names or (key, attribute name) pairs, functions to
+        convert field values, keyed on the JSON key, and a type tag.
+
+        From this, functions are generated for the class:
+
+        to_json(obj) returns the dict, and is registered as the class's
+        adapter, taking precedence over any __json__ method.
+
+        to_text(obj) returns the JSON text directly, without building the
+        dict or the generic dispatch, and is used by iterencode_records,
+        dump_records and dump_ndjson. The text is the same as CustomEncoder
+        gives.
+
+    Examples
+    --------
+
+    >>> @json_shape(['x', ('when', 'created')], type_tag='foo',
+    >>>             converters=dict(when=datetime_adapter))
+    >>> class Foo(object):
+    >>>     ...
+    >>>
+    >>> json.dumps(Foo(), cls=CustomEncoder)
+    {"type": "foo", "x": 5, "when": "2013-05-30T09:30:00"}
+    """
+    def __init__(self, fields, type_tag=None, tag_field='type',
+                 converters=None):
+        self.fields = [field if isinstance(field, tuple) else (field, field)
+                       for field in fields]
+        for key, attribute in self.fields:
+            if not _IDENTIFIER.match(attribute):
+                raise ValueError("Invalid attribute name {!r}".format(
+                    attribute))
+        self.type_tag = type_tag
+        self.tag_field = tag_field
+        self.converters = dict(converters or {})
+        self.cls = None
+        self.to_json = self._build_to_json()
+        self.to_text = self._build_to_text()
+
+    def _values(self, namespace):
+        """ Return the source of the expression for each field's value,
+            adding the converters they use to namespace.
+        """
+        values = []
+        for index, (key, attribute) in enumerate(self.fields):
+            value = 'obj.{}'.format(attribute)
+            if key in self.converters:
+                name = '_convert_{}'.format(index)
+                namespace[name] = self.converters[key]
+                value = '{}({})'.format(name, value)
+            values.append(value)
+        return values
+
+    def _compile(self, name, body, namespace):
+        source = 'def {}(obj):\n    return {}\n'.format(name, body)
+        exec(compile(source, '<JSONShape {}>'.format(name), 'exec'),
+             namespace)
+        return namespace[name]
+
+    def _build_to_json(self):
+        namespace = {}
+        items = []
+        if self.type_tag is not None:
+            items.append('{!r}: {!r}'.format(self.tag_field, self.type_tag))
+        for (key, _), value in zip(self.fields, self._values(namespace)):
+            items.append('{!r}: {}'.format(key, value))
+        return self._compile('to_json', '{' + ', '.join(items) + '}',
+                             namespace)
+
+    def _build_to_text(self):
+        namespace = dict(_encode_value=_encode_value)
+        items = []
+        if self.type_tag is not None:
+            items.append((self.tag_field, repr(_encode_value(self.type_tag))))
+        for (key, _), value in zip(self.fields, self._values(namespace)):
+            items.append((key, '_encode_value({})'.format(value)))
+        # Alternate constant text and value expressions
+        pieces = []
+        text = '{'
+        for index, (key, value) in enumerate(items):
+            text += (', ' if index else '') + encode_basestring_ascii(key)
+            pieces.extend([repr(text + ': '), value])
+            text = ''
+        pieces.append(repr(text + '}'))
+        return self._compile('to_text', ' + '.join(pieces), namespace)
+
+    def register(self, cls):
+        """ Use this shape for cls, returning cls.
+        """
+        self.cls = cls
+        _SHAPES[cls] = self
+        add_adapter(cls, self.to_json)
+        return cls
+
+    def encode_many(self, objs):
+        """ Return a JSON list of objs, all of the registered class.
+        """
+        return '[' + ', '.join([self.to_text(obj) for obj in objs]) + ']'
+
+
+def json_shape(fields, type_tag=None, tag_field='type', converters=None):
+    """ Class decorator, declaring the class's JSONShape.
+    """
+    return JSONShape(fields, type_tag, tag_field, converters).register
+
+
+# Raises the standard TypeError for types with no encoding
+_PLAIN_ENCODER = json.JSONEncoder()
+
+
+def encode_default(obj):
+    """ The CustomEncoder rules as a function, for the default argument of
+        json.dumps and other encoders: use __json__ or a registered
+        adapter, else raise TypeError.
+    """
+    encode = _dispatch(obj)
+    if encode is not None:
+        return encode(obj)
+    return _PLAIN_ENCODER.default(obj)
+
+
+class JSONBackend(object):
+    """ Encoder used by dumps. Backends only differ in speed and layout
+        (whitespace, escaping): they all decode to the same value.
+
+        Each backend has a name, and dumps(obj) returning obj encoded as
+        a JSON string.
+    """
+    name = None
+
+
+class StdlibBackend(JSONBackend):
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=CustomEncoder)
+
+
+class OrjsonBackend(JSONBackend):
+    """ Encode with orjson, falling back to the standard library for
+        anything orjson rejects (dict keys other than strings, integers
+        over 64 bits, or types with no encoding, which then raise the
+        usual TypeError).
+
+        orjson encodes enums and uuid.UUID itself, never asking __json__
+        or the adapters, and writes NaN and Infinity as null. Anything
+        holding those goes to the standard library, which encodes them as
+        CustomEncoder does, or raises TypeError.
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        import enum
+        import uuid
+        import orjson
+        self._dumps = orjson.dumps
+        # Send datetimes and dataclasses to the adapters, as CustomEncoder
+        self._option = (orjson.OPT_PASSTHROUGH_DATETIME |
+                        orjson.OPT_PASSTHROUGH_DATACLASS)
+        # Types orjson encodes without calling default
+        self._native = (enum.Enum, uuid.UUID)
+        # type -> True if orjson would encode it natively
+        self._native_types = {}
+
+    def _needs_stdlib(self, value):
+        """ True if value is, or holds in its lists and dicts, a value
+            orjson encodes differently to CustomEncoder.
+        """
+        if isinstance(value, float):
+            return math.isnan(value) or math.isinf(value)
+        if isinstance(value, dict):
+            return any(self._needs_stdlib(item) for item in value.values())
+        if isinstance(value, (list, tuple)):
+            return any(self._needs_stdlib(item) for item in value)
+        value_type = type(value)
+        try:
+            return self._native_types[value_type]
+        except KeyError:
+            native = self._native_types[value_type] = issubclass(
+                value_type, self._native)
+            return native
+
+    def _default(self, obj):
+        value = encode_default(obj)
+        if self._needs_stdlib(value):
+            # orjson would encode this itself; the stdlib re-encodes it all
+            raise TypeError("Not encoded by orjson")
+        return value
+
+    def dumps(self, obj):
+        if self._needs_stdlib(obj):
+            return _STDLIB_BACKEND.dumps(obj)
+        try:
+            text = self._dumps(obj, default=self._default,
+                               option=self._option)
+        except TypeError:
+            return _STDLIB_BACKEND.dumps(obj)
+        return text.decode('utf-8')
+
+
+class UjsonBackend(JSONBackend):
+    """ Encode with ujson (5 or later), falling back to the standard
+        library for anything ujson rejects. ujson treats __json__ as
+        returning raw JSON text, so objects with __json__ always fall back.
+    """
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._dumps = ujson.dumps
+
+    def dumps(self, obj):
+        try:
+            return self._dumps(obj, default=encode_default,
+                               escape_forward_slashes=False)
+        except (TypeError, ValueError, OverflowError):
+            return _STDLIB_BACKEND.dumps(obj)
+
+
+_STDLIB_BACKEND = StdlibBackend()
+
+# Backend classes, fastest first
+BACKENDS = (OrjsonBackend, UjsonBackend, StdlibBackend)
+_backends = {}
+
+
+def get_backend(name=None):
+    """ Return the named backend, or the fastest one installed. Raises
+        ImportError if the named backend isn't installed.
+    """
+    if name is None:
+        for backend_class in BACKENDS:
+            try:
+                return get_backend(backend_class.name)
+            except ImportError:
+                pass
+    try:
+        return _backends[name]
+    except KeyError:
+        pass
+    for backend_class in BACKENDS:
+        if backend_class.name == name:
+            backend = _backends[name] = backend_class()
+            return backend
+    raise ValueError("Unknown JSON backend {!r}".format(name))
+
+
+def available_backends():
+    """ Return the names of the installed backends, fastest first.
+    """
+    names = []
+    for backend_class in BACKENDS:
+        try:
+            get_backend(backend_class.name)
+        except ImportError:
+            continue
+        names.append(backend_class.name)
+    return names
+
+
+def dumps(obj, backend=None):
+    """ Encode obj with CustomEncoder rules, using the named backend, or
+        the fastest one installed.
+    """
+    return get_backend(backend).dumps(obj)
+
+
+def iterencode_records(records, cls=CustomEncoder, chunk_size=65536,
+                       **kwargs):
+    """ Encode an iterable of records as a JSON list, yielding the text in
+        chunks of about chunk_size characters as the records are read. The
+        first record is yielded straight away.
+
+        The text joined is the same as json.dumps(list(records), cls=cls,
+        **kwargs), without the indent option. Suitable as a WSGI app_iter,
+        once encoded.
+    """
+    if kwargs.get('indent') is not None:
+        raise ValueError("Streamed records can not be indented")
+    encoder = cls(**kwargs)
+    encode = encoder.encode
+    if cls is CustomEncoder and not kwargs:
+        encode = _shape_encoder(encode)
+    pieces = ['[']
+    size = 1
+    separator = ''
+    first = True
+    for record in records:
+        text = encode(record)
+        pieces.append(separator)
+        pieces.append(text)
+        separator = encoder.item_separator
+        size += len(separator) + len(text)
+        if first or size >= chunk_size:
+            yield ''.join(pieces)
+            pieces = []
+            size = 0
+            first = False
+    pieces.append(']')
+    yield ''.join(pieces)
+
+
+def dump_records(records, fp, cls=CustomEncoder, chunk_size=65536,
+                 encoding=None, **kwargs):
+    """ Write an iterable of records, as a JSON list, to a file-like
+        object or socket, as they are encoded. Memory use doesn't grow
+        with the number of records.
+
+        Text is written to file-like objects unless an encoding is given.
+        Sockets are sent bytes, encoded as UTF-8 by default.
+
+        Returns the number of records written.
+    """
+    if hasattr(fp, 'write'):
+        write = fp.write
+    else:
+        write = fp.sendall
+        encoding = encoding or 'utf-8'
+    counted = [0]
+
+    def counting(records):
+        for record in records:
+            counted[0] += 1
+            yield record
+
+    for chunk in iterencode_records(counting(records), cls, chunk_size,
+                                    **kwargs):
+        write(chunk.encode(encoding) if encoding else chunk)
+    return counted[0]
+
+
+# Decoding registry: tag field -> {tag value (or None for any) -> decoder}
+_DECODERS = {}
+
+
+def add_decoder(tag_field, decoder, tag_value=None):
+    """ Add a decoder to the global registry, for decoded JSON objects
+        (dicts) with tag_field set to tag_value, or with tag_field set to
+        anything if tag_value is None. The decoder is called with the dict
+        and returns the object to use instead.
+
+    Examples
+    --------
+
+    >>> add_decoder('type', lambda data: Foo(data['x']), 'foo')
+    >>> loads('{"type": "foo", "x": 5}')
+    <Foo x=5>
+    """
+    _DECODERS.setdefault(tag_field, {})[tag_value] = decoder
+
+
+def remove_decoder(tag_field, tag_value=None):
+    """ Remove a decoder added with add_decoder. Does nothing if there is
+        no such decoder.
+    """
+    decoders = _DECODERS.get(tag_field, {})
+    decoders.pop(tag_value, None)
+    if not decoders:
+        _DECODERS.pop(tag_field, None)
+
+
+# Date and time strings as isoformat() makes them
+_ISO_DATETIME = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)'
+    r'(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.(\d{1,6}))?)?)?'
+    r'(?:(Z)|([+-])(\d\d):?(\d\d))?$')
+
+# Bounded cache of parsed strings, see set_datetime_cache
+_datetime_cache = None
+
+
+def set_datetime_cache(maxsize=10000):
+    """ Cache the results of parse_datetime for up to maxsize strings, or
+        stop caching if maxsize is 0 or None. Returns the LRUCache used.
+    """
+    global _datetime_cache
+    if maxsize:
+        from pp.utils.cache import LRUCache
+        _datetime_cache = LRUCache(maxsize)
+    else:
+        _datetime_cache = None
+    return _datetime_cache
+
+
+def parse_iso_datetime(value):
+    """ Parse a string in the ISO 8601 forms isoformat() makes, returning
+        None for any other form.
+
+        Offsets are dateutil tzoffset instances, or tzutc for zero or 'Z'.
+        Raises ValueError for out of range fields.
+    """
+    match = _ISO_DATETIME.match(value)
+    if match is None:
+        return None
+    (year, month, day, hour, minute, second, fraction,
+     zulu, sign, offset_hours, offset_minutes) = match.groups()
+    tzinfo = None
+    if zulu or sign:
+        from dateutil.tz import tzutc, tzoffset
+        offset = 0
+        if sign:
+            offset = int(offset_hours) * 3600 + int(offset_minutes) * 60
+            if sign == '-':
+                offset = -offset
+        tzinfo = tzoffset(None, offset) if offset else tzutc()
+    return datetime.datetime(
+        int(year), int(month), int(day),
+        int(hour or 0), int(minute or 0), int(second or 0),
+        int(fraction.ljust(6, '0')) if fraction else 0,
+        tzinfo)
+
+
+def parse_datetime(value):
+    """ Parse an ISO format string, as made by datetime_adapter.
+
+        Falls back to dateutil for other forms, and uses the cache set up
+        by set_datetime_cache, if any.
+    """
+    cache = _datetime_cache
+    if cache is not None:
+        result = cache.get(value)
+        if result is not None:
+            return result
+    try:
+        result = parse_iso_datetime(value)
+    except ValueError:
+        result = None
+    if result is None:
+        import dateutil.parser
+        result = dateutil.parser.parse(value)
+    if cache is not None:
+        cache.set(value, result)
+    return result
+
+
+def _datetime_field(value):
+    if isinstance(value, basestring_):
+        return parse_datetime(value)
+    return value
+
+
+def make_object_hook(datetime_fields=(), fields=None):
+    """ Return an object_hook for json.loads, rebuilding registered types
+        as the JSON is parsed, in the one pass.
+
+        Dicts with a registered tag are passed to its decoder. In other
+        dicts, string values of the named datetime_fields are parsed to
+        datetimes, and values of fields, a dict of field name -> function,
+        are converted by the function.
+    """
+    converters = dict((name, _datetime_field) for name in datetime_fields)
+    converters.update(fields or {})
+
+    def object_hook(data):
+        for tag_field, decoders in _DECODERS.items():
+            if tag_field in data:
+                try:
+                    decoder = decoders.get(data[tag_field],
+                                           decoders.get(None))
+                except TypeError:
+                    # Unhashable tag values, like lists, name no decoder
+                    decoder = None
+                if decoder is not None:
+                    return decoder(data)
+        for name, convert in converters.items():
+            value = data.get(name)
+            if value is not None:
+                data[name] = convert(value)
+        return data
+
+    return object_hook
+
+
+def loads(text, datetime_fields=(), fields=None, **kwargs):
+    """ Decode JSON text, rebuilding registered types and converting the
+        named fields, see make_object_hook.
+    """
+    return json.loads(text, object_hook=make_object_hook(datetime_fields,
+                                                         fields), **kwargs)
+
+
+# Built-in decoders
+def timeref_decoder(data):
+    from pp.utils.timeref import SERIALISE_CLASS_LOOKUP
+    try:
+        timeref_class = SERIALISE_CLASS_LOOKUP[data['timeref_type']]
+    except KeyError:
+        return data
+    return timeref_class.fromJSON(data)
+
+add_decoder('timeref_type', timeref_decoder)
+
+
+# ------------------------------------------------------------------------
+# Newline-delimited JSON, optionally encoded and decoded in parallel
+# ------------------------------------------------------------------------
+
+def _chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _encode_ndjson_chunk(records, cls=CustomEncoder):
+    encode = cls().encode
+    if cls is CustomEncoder:
+        encode = _shape_encoder(encode)
+    return ''.join([encode(record) + '\n' for record in records])
+
+
+def _decode_ndjson_chunk(lines, datetime_fields=(), fields=None):
+    object_hook = make_object_hook(datetime_fields, fields)
+    return [json.loads(line, object_hook=object_hook)
+            for line in lines if line.strip()]
+
+
+def _map_ordered(function, chunks, workers, pool=None):
+    """ Yield function(chunk) for each chunk, in order, computed in a
+        process pool. At most 2 * workers chunks are in flight, so memory
+        use doesn't grow with the input.
+    """
+    own_pool = pool is None
+    if own_pool:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(function, (chunk,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        if own_pool:
+            pool.terminate()
+            pool.join()
+
+
+def dump_ndjson(records, fp, workers=None, chunk_size=1000,
+                cls=CustomEncoder, encoding=None, pool=None):
+    """ Write records to fp as newline-delimited JSON, one record per
+        line, encoded with cls. Returns the number of records written.
+
+        With workers > 1 (or a multiprocessing pool), chunks of chunk_size
+        records are encoded in a process pool. The output, in the same
+        order, is identical to encoding in one process. Adapters added at
+        runtime are only seen by workers forked after they were added.
+
+        Text is written unless an encoding is given.
+    """
+    count = 0
+    chunks = _chunks(records, chunk_size)
+    if pool is None and (workers or 1) <= 1:
+        encoded = (_encode_ndjson_chunk(chunk, cls) for chunk in chunks)
+    else:
+        import multiprocessing
+        workers = workers or multiprocessing.cpu_count()
+        encoded = _map_ordered(
+            functools.partial(_encode_ndjson_chunk, cls=cls), chunks,
+            workers, pool)
+    for text in encoded:
+        count += text.count('\n')
+        fp.write(text.encode(encoding) if encoding else text)
+    return count
+
+
+def load_ndjson(fp, workers=None, chunk_size=1000, datetime_fields=(),
+                fields=None, pool=None):
+    """ Yield the records in newline-delimited JSON, read from fp (or any
+        iterable of lines), rebuilding registered types and converting
+        fields as loads does. Blank lines are skipped.
+
+        With workers > 1 (or a multiprocessing pool), chunks of chunk_size
+        lines are decoded in a process pool, and the records yielded in
+        order. The fields converters must then be picklable functions.
+    """
+    chunks = _chunks(fp, chunk_size)
+    if pool is None and (workers or 1) <= 1:
+        decoded = (_decode_ndjson_chunk(chunk, datetime_fields, fields)
+                   for chunk in chunks)
+    else:
+        import multiprocessing
+        workers = workers or multiprocessing.cpu_count()
+        decoded = _map_ordered(
+            functools.partial(_decode_ndjson_chunk,
+                              datetime_fields=tuple(datetime_fields),
+                              fields=fields),
+            chunks, workers, pool)
+    for records in decoded:
+        for record in records:
+            yield record
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/phonetic_index.py
+"""
+In-memory phonetic blocking index, for finding likely duplicate names.
+
+Names are reduced to metaphone tokens by id_maker.process_stop_words, and
+each token keeps a bucket of the names containing it. A query only looks
+at the names sharing a token with it, instead of at every name, so the
+cost grows with the bucket sizes rather than the size of the corpus.
+
+e.g.  index = PhoneticIndex()
+      index.insert('c1', "Vodafone Group Plc")
+      index.insert('c2', "Lloyds Bank Ltd")
+      index.candidates("Vodaphone")
+      --> [('c1', 1)]
+      index.candidates("Vodaphone", rerank='jaro_winkler')
+      --> [('c1', 0.93...)]
+"""
+from collections import defaultdict
+
+import jellyfish as jf
+
+from pp.utils.id_maker import process_stop_words, remove_stop_words
+
+# jellyfish renamed jaro_winkler to jaro_winkler_similarity in 0.8
+_jaro_winkler = getattr(jf, 'jaro_winkler_similarity', None) or getattr(
+    jf, 'jaro_winkler', None)
+
+
+def _levenshtein(name, other):
+    longest = max(len(name), len(other))
+    if not longest:
+        return 1.0
+    return 1.0 - float(jf.levenshtein_distance(name, other)) / longest
+
+
+RERANKERS = dict(
+    jaro_winkler=_jaro_winkler,
+    levenshtein=_levenshtein,
+)
+
+
+def phonetic_tokens(name):
+    """Return the set of metaphone tokens for a name."""
+    return set(token for token in process_stop_words(name).split() if token)
+
+
+class PhoneticIndex(object):
+    """Index of names by key, blocked on their metaphone tokens."""
+
+    def __init__(self):
+        # token -> set of keys
+        self._buckets = defaultdict(set)
+        # key -> (name, tokens)
+        self._names = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, key):
+        return key in self._names
+
+    def insert(self, key, name):
+        """Add a name under key, replacing any name already there."""
+        if key in self._names:
+            self.remove(key)
+        tokens = phonetic_tokens(name)
+        self._names[key] = (name, tokens)
+        for token in tokens:
+            self._buckets[token].add(key)
+
+    def remove(self, key):
+        """Remove the name under key. Raises KeyError if there isn't one."""
+        name, tokens = self._names.pop(key)
+        for token in tokens:
+            bucket = self._buckets[token]
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[token]
+
+    def bucket_sizes(self):
+        """Return a dict of token -> number of names with it."""
+        return dict((token, len(keys))
+                    for token, keys in self._buckets.items())
+
+    def candidates(self, name, rerank=None, limit=None):
+        """Return (key, score) pairs for the names sharing a token with
+        name, best first.
+
+        Without rerank, the score is the number of shared tokens. With
+        rerank 'jaro_winkler' or 'levenshtein' (or a function of two
+        strings), the score is the similarity of the names, less their
+        stop words, computed for the candidates only.
+        """
+        shared = defaultdict(int)
+        for token in phonetic_tokens(name):
+            for key in self._buckets.get(token, ()):
+                shared[key] += 1
+        if rerank is None:
+            scored = shared.items()
+        else:
+            similarity = RERANKERS.get(rerank, rerank)
+            if not callable(similarity):
+                raise ValueError("Unknown rerank {!r}".format(rerank))
+            plain_name = remove_stop_words(name)
+            scored = [
+                (key, similarity(plain_name,
+                                 remove_stop_words(self._names[key][0])))
+                for key in shared
+            ]
+        ranked = sorted(scored, key=lambda pair: pair[1], reverse=True)
+        return ranked[:limit] if limit is not None else ranked
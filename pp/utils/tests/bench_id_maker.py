@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/tests/bench_id_maker.py
+"""
+Benchmarks for the pp.utils.id_maker hot paths.
+
+Each benchmark is run at several input sizes and, for the name-based
+ones, several name distributions, and reports the per-call latency and
+throughput. Results can be saved as a baseline and later runs compared
+against it, failing when anything is slower than the threshold.
+
+Run from the package directory::
+
+    python -m pp.utils.tests.bench_id_maker --save baseline.json
+    python -m pp.utils.tests.bench_id_maker --compare baseline.json \\
+        --threshold 0.25
+
+This is not collected by py.test, as timings vary too much for a test.
+"""
+from __future__ import print_function
+
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+
+import pp.utils.id_maker as idm
+
+DEFAULT_SIZES = (100, 1000, 10000)
+
+# Name distributions
+UNIQUE = 'unique'        # every name different
+REPEATED = 'repeated'    # Zipf-like draws from a pool of 100 names
+SHORT = 'short'          # single short words, mostly padded
+
+DISTRIBUTIONS = (UNIQUE, REPEATED, SHORT)
+
+_WORDS = [
+    "vodafone", "lloyds", "bank", "apple", "microsoft", "amazon", "global",
+    "capital", "energy", "mining", "british", "american", "pacific",
+    "resources", "telecom", "pharma", "motors", "airlines", "steel", "foods",
+]
+_SUFFIXES = ["Ltd", "Inc", "Plc", "Group", "Holdings", "Corporation", "", ""]
+
+
+def make_names(size, distribution, seed=1):
+    """Return size company names, drawn from distribution."""
+    rand = random.Random(seed)
+
+    def company(index):
+        words = rand.sample(_WORDS, rand.randint(1, 3))
+        return "{} {} {}".format(" ".join(w.title() for w in words),
+                                 index, rand.choice(_SUFFIXES)).strip()
+
+    if distribution == UNIQUE:
+        return [company(index) for index in range(size)]
+    if distribution == REPEATED:
+        pool = [company(index) for index in range(100)]
+        return [pool[min(int(rand.paretovariate(1.2)) - 1, 99)]
+                for _ in range(size)]
+    if distribution == SHORT:
+        return [rand.choice(_WORDS)[:rand.randint(1, 4)].upper()
+                for _ in range(size)]
+    raise ValueError("Unknown distribution {!r}".format(distribution))
+
+
+def bench_hihat(size, distribution):
+    names = make_names(size, distribution)
+
+    def run():
+        for name in names:
+            idm.hihat(name, 6)
+    return run
+
+
+def bench_hihat_engine(size, distribution):
+    names = make_names(size, distribution)
+
+    def run():
+        idm.HihatEngine(6).hihat_many(names)
+    return run
+
+
+def bench_uuid_base64(size, distribution):
+    def run():
+        for _ in range(size):
+            idm.uuid_base64()
+    return run
+
+
+def bench_uuid2slug(size, distribution):
+    uuid_strs = [str(uuid.uuid4()) for _ in range(size)]
+
+    def run():
+        for uuid_str in uuid_strs:
+            idm.uuid2slug(uuid_str)
+    return run
+
+
+def bench_slug2uuid(size, distribution):
+    slugs = [idm.uuid_base64() for _ in range(size)]
+
+    def run():
+        for slug in slugs:
+            idm.slug2uuid(slug)
+    return run
+
+
+def bench_uuids2slugs(size, distribution):
+    uuid_bytes = b''.join(uuid.uuid4().bytes for _ in range(size))
+
+    def run():
+        idm.uuids2slugs(uuid_bytes)
+    return run
+
+
+def bench_slugs2uuids(size, distribution):
+    slugs = [idm.uuid_base64() for _ in range(size)]
+
+    def run():
+        idm.slugs2uuids(slugs)
+    return run
+
+
+def bench_id_generator_send(size, distribution):
+    def run():
+        id_gen = idm.id_generator('pp-usr')
+        for _ in range(size):
+            id_gen(0)
+    return run
+
+
+def bench_id_generator_send_names(size, distribution):
+    names = make_names(size, distribution)
+
+    def run():
+        id_gen = idm.id_generator('pp-usr')
+        for name in names:
+            id_gen(name)
+    return run
+
+
+def bench_generate_many(size, distribution):
+    def run():
+        idm.id_generator('pp-usr').generate_many(size)
+    return run
+
+
+# name -> (function, takes a name distribution)
+BENCHMARKS = dict(
+    hihat=(bench_hihat, True),
+    hihat_engine=(bench_hihat_engine, True),
+    uuid_base64=(bench_uuid_base64, False),
+    uuid2slug=(bench_uuid2slug, False),
+    slug2uuid=(bench_slug2uuid, False),
+    uuids2slugs=(bench_uuids2slugs, False),
+    slugs2uuids=(bench_slugs2uuids, False),
+    id_generator_send=(bench_id_generator_send, False),
+    id_generator_send_names=(bench_id_generator_send_names, True),
+    generate_many=(bench_generate_many, False),
+)
+
+
+def time_call(run, repeat=5):
+    """Return the best time, in seconds, of repeat calls to run."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        taken = time.perf_counter() - started
+        if best is None or taken < best:
+            best = taken
+    return best
+
+
+def run_benchmarks(names=None, sizes=DEFAULT_SIZES,
+                   distributions=DISTRIBUTIONS, repeat=5, out=None):
+    """Run the benchmarks, returning a dict of result key -> dict of
+    per_call_us and calls_per_sec. Progress is printed to out, if given.
+    """
+    results = {}
+    for name in sorted(names or BENCHMARKS):
+        bench, uses_names = BENCHMARKS[name]
+        for distribution in (distributions if uses_names else [None]):
+            for size in sizes:
+                key = ':'.join(str(part) for part in
+                               (name, distribution or '-', size))
+                seconds = time_call(bench(size, distribution), repeat)
+                results[key] = dict(
+                    per_call_us=seconds * 1e6 / size,
+                    calls_per_sec=size / seconds if seconds else 0.0,
+                )
+                if out is not None:
+                    print("{:<45} {:>10.3f} us/call {:>14,.0f} calls/s".format(
+                        key, results[key]['per_call_us'],
+                        results[key]['calls_per_sec']), file=out)
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    """Return (key, baseline us, current us, slowdown) for every result
+    more than threshold (a fraction) slower than its baseline.
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        before = baseline[key]['per_call_us']
+        after = result['per_call_us']
+        slowdown = (after - before) / before if before else 0.0
+        if slowdown > threshold:
+            regressions.append((key, before, after, slowdown))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('benchmarks', nargs='*',
+                        help="Benchmarks to run (default all): {}".format(
+                            ", ".join(sorted(BENCHMARKS))))
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=list(DEFAULT_SIZES))
+    parser.add_argument('--distributions', nargs='+',
+                        default=list(DISTRIBUTIONS), choices=DISTRIBUTIONS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='FILE',
+                        help="Save the results as a JSON baseline")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="Compare with a saved JSON baseline")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Slowdown that fails the comparison, as a "
+                             "fraction (default 0.2)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.benchmarks, args.sizes,
+                             args.distributions, args.repeat, sys.stdout)
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        for key, before, after, slowdown in regressions:
+            print("SLOWER {:<38} {:>10.3f} -> {:>10.3f} us/call "
+                  "(+{:.0%})".format(key, before, after, slowdown))
+        if regressions:
+            return 1
+        print("No regressions over {:.0%}".format(args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
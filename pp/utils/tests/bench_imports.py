@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/tests/bench_imports.py
+"""
+Benchmark the time taken to import pp.utils modules.
+
+Each module is imported in a fresh interpreter, and the time taken to
+import it is reported over that of importing pp.utils itself, so the
+cost shared by every module (the interpreter and the pp namespace
+package) is left out. The heavy optional dependencies each import has
+loaded are listed alongside, as they are the usual cause of slow starts.
+Results can be saved and compared as for bench_id_maker.
+
+Run from the package directory::
+
+    python -m pp.utils.tests.bench_imports --save imports.json
+    python -m pp.utils.tests.bench_imports --compare imports.json
+
+This is not collected by py.test, as timings vary too much for a test.
+"""
+from __future__ import print_function
+
+import sys
+import json
+import argparse
+import subprocess
+
+from pp.utils.tests.bench_id_maker import compare
+
+MODULES = (
+    'pp.utils.cache',
+    'pp.utils.id_maker',
+    'pp.utils.json_',
+    'pp.utils.timeref',
+    'pp.utils.phonetic_index',
+    'pp.utils.id_server',
+)
+
+# Dependencies that should only be imported when first used
+HEAVY_MODULES = (
+    'jellyfish',
+    'zope.interface',
+    'dateutil',
+    'multiprocessing',
+    'sqlite3',
+    'numpy',
+)
+
+_SCRIPT = """
+import sys, time, json
+import pp.utils
+started = time.perf_counter()
+import {module}
+taken = time.perf_counter() - started
+print(json.dumps(dict(seconds=taken,
+                      loaded=[m for m in {heavy!r} if m in sys.modules])))
+"""
+
+
+def import_module(module, python=sys.executable):
+    """Import module in a new interpreter, returning a dict of the
+    seconds taken and the list of HEAVY_MODULES it loaded.
+    """
+    output = subprocess.check_output([python, '-c', _SCRIPT.format(
+        module=module, heavy=HEAVY_MODULES)])
+    return json.loads(output.decode('utf-8'))
+
+
+def run_benchmarks(modules=None, repeat=5, out=None):
+    """Import each module repeat times, returning a dict of module ->
+    dict of per_call_us (the best time) and loaded. Progress is printed
+    to out, if given.
+    """
+    results = {}
+    for module in modules or MODULES:
+        runs = [import_module(module) for _ in range(repeat)]
+        results[module] = dict(
+            per_call_us=min(run['seconds'] for run in runs) * 1e6,
+            loaded=runs[0]['loaded'],
+        )
+        if out is not None:
+            print("{:<28} {:>10.1f} ms  {}".format(
+                module, results[module]['per_call_us'] / 1000,
+                ", ".join(results[module]['loaded']) or '-'), file=out)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('modules', nargs='*',
+                        help="Modules to import (default {})".format(
+                            ", ".join(MODULES)))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='FILE',
+                        help="Save the results as a JSON baseline")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="Compare with a saved JSON baseline")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Slowdown that fails the comparison, as a "
+                             "fraction (default 0.2)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.modules, args.repeat, sys.stdout)
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        for key, before, after, slowdown in regressions:
+            print("SLOWER {:<28} {:>10.1f} -> {:>10.1f} ms "
+                  "(+{:.0%})".format(key, before / 1000, after / 1000,
+                                     slowdown))
+        if regressions:
+            return 1
+        print("No regressions over {:.0%}".format(args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
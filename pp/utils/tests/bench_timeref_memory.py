@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/tests/bench_timeref_memory.py
+"""
+Measure the memory taken by each kind of pp.utils.timeref object.
+
+Many instances of each are made, each with its own datetimes as if
+parsed from separate documents, and the bytes allocated per instance
+are reported, as traced by tracemalloc.
+
+Run from the package directory::
+
+    python -m pp.utils.tests.bench_timeref_memory --count 100000
+
+This is not collected by py.test, as it is slow and only informative.
+"""
+from __future__ import print_function
+
+import sys
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+from pp.utils import timeref
+
+_BASE = datetime(2013, 8, 14)
+
+
+def _when(index):
+    return _BASE + timedelta(seconds=index, microseconds=index % 1000)
+
+
+def make_point_in_time(index):
+    return timeref.PointInTime(_when(index))
+
+
+def make_duration(index):
+    return timeref.Duration(minutes=index)
+
+
+def make_repeating(index):
+    return timeref.RepeatingTimeReference(_when(index), 15,
+                                          end_after_time=_when(index + 3600))
+
+
+def make_date_range(index):
+    return timeref.DateRange(_when(index), _when(index + 3600))
+
+
+def make_compact_date_range(index):
+    return timeref.CompactDateRange(_when(index), _when(index + 3600))
+
+
+KINDS = dict(
+    PointInTime=make_point_in_time,
+    Duration=make_duration,
+    RepeatingTimeReference=make_repeating,
+    DateRange=make_date_range,
+    CompactDateRange=make_compact_date_range,
+)
+
+
+def bytes_per_object(make, count):
+    """Return the bytes allocated per object for count calls of make."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [make(index) for index in range(count)]
+        taken = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    # Less the list holding them
+    taken -= sys.getsizeof(objects)
+    return float(taken) / count
+
+
+def run_benchmarks(kinds=None, count=100000, out=None):
+    """Return a dict of kind -> bytes per object, printing each to out,
+    if given.
+    """
+    results = {}
+    for kind in sorted(kinds or KINDS):
+        results[kind] = bytes_per_object(KINDS[kind], count)
+        if out is not None:
+            print("{:<24} {:>8.1f} bytes".format(kind, results[kind]),
+                  file=out)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('kinds', nargs='*',
+                        help="Kinds to measure (default all): {}".format(
+                            ", ".join(sorted(KINDS))))
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args(argv)
+    run_benchmarks(args.kinds, args.count, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
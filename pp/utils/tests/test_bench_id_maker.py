@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/tests/test_bench_id_maker.py
+
+from pp.utils.tests import bench_id_maker as bench
+
+
+def test_run_benchmarks_smoke():
+    results = bench.run_benchmarks(['hihat', 'uuid2slug'], sizes=[10],
+                                   distributions=[bench.REPEATED], repeat=1)
+    assert sorted(results) == ['hihat:repeated:10', 'uuid2slug:-:10']
+    assert all(r['per_call_us'] > 0 for r in results.values())
+
+
+def test_compare_finds_regressions():
+    baseline = {'a:-:10': dict(per_call_us=1.0),
+                'b:-:10': dict(per_call_us=1.0)}
+    results = {'a:-:10': dict(per_call_us=1.1),
+               'b:-:10': dict(per_call_us=1.5),
+               'c:-:10': dict(per_call_us=9.0)}
+    assert bench.compare(results, baseline, 0.2) == [
+        ('b:-:10', 1.0, 1.5, 0.5)]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/tests/test_bench_imports.py
+
+import pytest
+
+from pp.utils.tests import bench_imports as bench
+
+
+@pytest.mark.parametrize('module', [
+    'pp.utils.id_maker',
+    'pp.utils.json_',
+    'pp.utils.timeref',
+])
+def test_import_defers_heavy_modules(module):
+    assert bench.import_module(module)['loaded'] == []
+
+
+def test_run_benchmarks_smoke():
+    results = bench.run_benchmarks(['pp.utils.cache'], repeat=1)
+    assert list(results) == ['pp.utils.cache']
+    assert results['pp.utils.cache']['per_call_us'] > 0
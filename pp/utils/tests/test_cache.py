@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/tests/test_cache.py
+
+from pp.utils.cache import LRUCache
+
+
+def test_lru_cache_get_and_set():
+    cache = LRUCache(maxsize=2)
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    assert 'a' in cache
+    assert cache.stats() == dict(hits=1, misses=1, size=1, maxsize=2)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert len(cache) == 2
+
+
+def test_lru_cache_clear():
+    cache = LRUCache()
+    cache.set('a', 1)
+    cache.get('a')
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats()['hits'] == 0
@@ -3,6 +3,9 @@
 
 from __future__ import absolute_import
 
+import os
+import datetime
+import multiprocessing
 import uuid
 
 import pytest
@@ -62,6 +65,37 @@ def test_hihat_with_known_abbrevs(abbrevs, long_name, expected_abbrev):
         assert idm.hihat(long_name, 4) == expected_abbrev
 
 
+@mark.parametrize('long_name', [
+    "Vodafone", "BMW", "Lloyds Bank Ltd", "Microsoft", "Apple Inc",
+    "Bank of America Corporation", "The Coca-Cola Company", "AB", "",
+])
+@mark.parametrize('short_name_length', [1, 4, 6])
+def test_hihat_engine_matches_hihat(long_name, short_name_length):
+    engine = idm.HihatEngine(short_name_length)
+    expected = idm.hihat(long_name, short_name_length)
+    assert engine.hihat(long_name) == expected
+    # Again, from the cache
+    assert engine.hihat(long_name) == expected
+
+
+def test_hihat_engine_with_stop_words_and_abbrevs():
+    engine = idm.HihatEngine(stop_words=["limited"],
+                             known_abbreviations=dict(cisco="csco"))
+    assert engine("Lloyds Bank Ltd") == 'lblx'
+    assert engine("Cisco") == 'csco'
+    assert engine("Microsoft") == 'micr'
+
+
+def test_hihat_many_and_cache_info():
+    engine = idm.HihatEngine(cache_size=2)
+    names = ["Vodafone", "BMW", "VODAFONE", "Vodafone"]
+    assert engine.hihat_many(names) == ['voda', 'bmwx', 'voda', 'voda']
+    assert engine.hihat_many(["BMW"], 6) == ['bmwxxx']
+    assert engine.cache_info() == dict(hits=2, misses=3, size=2, maxsize=2)
+    engine.cache_clear()
+    assert engine.cache_info()['size'] == 0
+
+
 @mark.parametrize('uuid_str, slug', [
     ('aab4aa8d-0624-47c6-aa61-22d09ee426cc', 'qrSqjQYkR8aqYSLQnuQmzA'),
     ('158b7e0c-3826-4827-a2ab-8314a14b9d0e', 'FYt$DDgmSCeiq4MUoUudDg'),
@@ -93,6 +127,86 @@ def test_uuid_base64():
     valid_uuid = uuid.UUID(u4)
 
 
+UUID_SLUGS = [
+    ('aab4aa8d-0624-47c6-aa61-22d09ee426cc', 'qrSqjQYkR8aqYSLQnuQmzA'),
+    ('158b7e0c-3826-4827-a2ab-8314a14b9d0e', 'FYt$DDgmSCeiq4MUoUudDg'),
+    ('56a4f614-fb4b-4e80-909c-797f969adf9b', 'VqT2FPtLToCQnHl_lprfmw'),
+    ('904ff1c0-7108-485f-8339-19d8bd2e843e', 'kE_xwHEISF$DORnYvS6EPg'),
+]
+
+
+def test_uuids_to_slugs_and_back():
+    uuid_strs = [uuid_str for uuid_str, _ in UUID_SLUGS]
+    slugs = [slug for _, slug in UUID_SLUGS]
+    uuid_bytes = b''.join(uuid.UUID(u).bytes for u in uuid_strs)
+    assert idm.uuids2slugs(uuid_strs) == slugs
+    assert idm.uuids2slugs([uuid.UUID(u) for u in uuid_strs]) == slugs
+    assert idm.uuids2slugs(uuid_bytes) == slugs
+    assert idm.slugs2uuids(slugs) == uuid_bytes
+    assert idm.slugs2uuids([]) == b''
+
+
+@mark.parametrize('slug', [
+    'qrSqjQYkR8aqYSLQnuQmz',
+    'qrSqjQYkR8aqYSLQnuQm!A',
+    'qrSqjQYkR8aqYSLQnuQmzAA',
+])
+def test_slugs_to_uuids_invalid(slug):
+    with pytest.raises(ValueError):
+        idm.slugs2uuids(['FYt$DDgmSCeiq4MUoUudDg', slug])
+
+
+def test_uuids_to_slugs_invalid():
+    with pytest.raises(ValueError):
+        idm.uuids2slugs(['aab4aa8d-0624-47c6-aa61'])
+    with pytest.raises(ValueError):
+        idm.uuids2slugs(b'0' * 17)
+
+
+def test_uuids_to_slugs_arrays():
+    np = pytest.importorskip('numpy')
+    slugs = np.array([slug for _, slug in UUID_SLUGS], dtype='S22')
+    uuid_array = idm.slugs2uuids(slugs)
+    assert uuid_array.dtype == np.dtype('S16')
+    assert uuid_array.tobytes() == b''.join(
+        uuid.UUID(u).bytes for u, _ in UUID_SLUGS)
+    slug_array = idm.uuids2slugs(uuid_array)
+    assert slug_array.dtype == np.dtype('S22')
+    assert (slug_array == slugs).all()
+    with pytest.raises(ValueError):
+        idm.slugs2uuids(np.array(['qrSqjQYkR8aqYSLQnuQm!A']))
+    with pytest.raises(ValueError):
+        idm.slugs2uuids(np.array([u'qrSqjQYkR8aqYSLQnuQm\xe9A']))
+    # Longer slugs are rejected, rather than cut to 22 chars
+    long_slug = UUID_SLUGS[0][1] + 'Q'
+    for dtype in ('U23', 'S23', object):
+        with pytest.raises(ValueError):
+            idm.slugs2uuids(np.array([long_slug], dtype=dtype))
+    # Wider arrays of valid slugs are fine
+    assert idm.slugs2uuids(np.array(
+        [slug for _, slug in UUID_SLUGS], dtype='U30')).tobytes() == \
+        uuid_array.tobytes()
+
+
+def test_uuids_to_slugs_array_dtypes():
+    np = pytest.importorskip('numpy')
+    uuid_strs = [u for u, _ in UUID_SLUGS]
+    expected = [slug.encode('ascii') for _, slug in UUID_SLUGS]
+    raw = b''.join(uuid.UUID(u).bytes for u in uuid_strs)
+    arrays = [
+        np.frombuffer(raw, dtype='V16'),
+        np.frombuffer(raw, dtype=np.uint8).reshape(-1, 16),
+        np.array(uuid_strs),
+        np.array(uuid_strs, dtype='S36'),
+    ]
+    for array in arrays:
+        assert idm.uuids2slugs(array).tolist() == expected
+    with pytest.raises(ValueError):
+        idm.uuids2slugs(np.array(['aab4aa8d-0624-47c6-aa61-22d09ee426cX']))
+    with pytest.raises(ValueError):
+        idm.uuids2slugs(np.arange(16))
+
+
 @pytest.fixture(scope='module')
 def id_gen_sec():
     return idm.id_generator('pp-sec', start_at=10001)
@@ -131,6 +245,273 @@ def test_get_security_ids(arg1, start_of_id, id_gen_sec):
 def test_get_sequential_id():
     pass
 
+
+def test_generate_many_continues_counter():
+    id_gen = idm.id_generator('pp-usr', start_at=101)
+    assert id_gen(0).startswith('pp-usr-000101-')
+    ids = id_gen.generate_many(3)
+    assert [i[:14] for i in ids] == ['pp-usr-000102-',
+                                     'pp-usr-000103-',
+                                     'pp-usr-000104-']
+    assert id_gen(0).startswith('pp-usr-000105-')
+
+
+def test_generate_many_matches_send():
+    names = [0, 5001, 0, "John Smith", 0]
+    id_gen_one = idm.id_generator('pp-usr', start_at=101)
+    id_gen_many = idm.id_generator('pp-usr', start_at=101)
+    expected = [id_gen_one(name)[:-22] for name in names]
+    ids = id_gen_many.generate_many(len(names), names)
+    assert [i[:-22] for i in ids] == expected
+    assert all(len(i) == 36 for i in ids)
+
+
+def test_generate_many_slugs_are_uuid4():
+    ids = idm.id_generator('pp-sec').generate_many(50)
+    assert len(set(ids)) == 50
+    for i in ids:
+        uuid_str = idm.slug2uuid(i[-22:])
+        assert uuid.UUID(uuid_str).version == 4
+        assert idm.uuid2slug(uuid_str) == i[-22:]
+
+
+def test_generate_many_wrong_number_of_names():
+    with pytest.raises(ValueError):
+        idm.id_generator('pp-sec').generate_many(2, [0])
+
+
+def test_time_slugs_sort_in_order_made():
+    slugs = [idm.time_slug() for _ in range(100)] + idm.time_slugs(3000)
+    assert len(set(slugs)) == len(slugs)
+    assert sorted(slugs) == slugs
+    uuid_bytes = [uuid.UUID(idm.slug2uuid(slug)).bytes for slug in slugs]
+    assert sorted(uuid_bytes) == uuid_bytes
+    assert [idm.uuid2slug(idm.slug2uuid(s)) for s in slugs] == slugs
+
+
+def test_time_slug_time():
+    before = datetime.datetime.utcnow() - datetime.timedelta(milliseconds=1)
+    slug = idm.time_slug()
+    after = datetime.datetime.utcnow() + datetime.timedelta(milliseconds=1)
+    assert before <= idm.slug_time(slug) <= after
+    assert idm.time_slug_floor(before) < slug < idm.time_slug_floor(after)
+    assert idm.slug_time(idm.time_slug_floor(before)) == before.replace(
+        microsecond=before.microsecond // 1000 * 1000)
+
+
+def test_id_generator_time_ordered():
+    id_gen = idm.id_generator('pp-usr', start_at=101, time_ordered=True)
+    ids = [id_gen(0)] + id_gen.generate_many(3)
+    assert [i[:14] for i in ids] == ['pp-usr-000101-', 'pp-usr-000102-',
+                                     'pp-usr-000103-', 'pp-usr-000104-']
+    slugs = [i[14:] for i in ids]
+    assert sorted(slugs) == slugs
+    assert all(len(i) == 36 for i in ids)
+
+
+def test_parsed_id():
+    parsed = idm.ParsedId.parse('pp-usr-000101-qrSqjQYkR8aqYSLQnuQmzA')
+    assert parsed.prefix == 'pp-usr'
+    assert parsed.readable == '000101'
+    assert parsed.counter == 101
+    assert parsed.uuid == uuid.UUID(
+        'aab4aa8d-0624-47c6-aa61-22d09ee426cc').bytes
+    assert str(parsed) == 'pp-usr-000101-qrSqjQYkR8aqYSLQnuQmzA'
+
+
+def test_parsed_id_word_and_hex_uuid():
+    parsed = idm.ParsedId.parse(
+        'pp-sec-voda-7bfec1a5d6b84703af918bee93000606')
+    assert parsed.prefix == 'pp-sec'
+    assert parsed.readable == 'voda'
+    assert parsed.counter is None
+    assert parsed.uuid == uuid.UUID('7bfec1a5d6b84703af918bee93000606').bytes
+
+
+def test_parsed_id_dashed_uuid():
+    parsed = idm.ParsedId.parse(
+        'pp-sec-3445-8d14e543-04de-4644-9715-3f44a4088f98')
+    assert parsed.prefix == 'pp-sec'
+    assert parsed.counter == 3445
+    assert parsed.uuid == uuid.UUID(
+        '8d14e543-04de-4644-9715-3f44a4088f98').bytes
+
+
+@mark.parametrize('separator', ['-', '_', '$'])
+def test_parsed_id_separator_in_slug(separator):
+    # Slugs use '$' and '_' as well as letters and digits
+    id_gen = idm.id_generator('pp{}usr'.format(separator),
+                              separator=separator)
+    ids = [id_gen(0) for _ in range(200)] + [id_gen("Vodafone")]
+    ids.append(separator.join(['pp', 'usr', '000001', '_$' * 10 + '_w']))
+    for some_id in ids:
+        parsed = idm.ParsedId.parse(some_id, separator)
+        assert parsed.prefix == 'pp{}usr'.format(separator)
+        assert str(parsed) == some_id
+
+
+@mark.parametrize('some_id', [
+    'qrSqjQYkR8aqYSLQnuQmzA',
+    'pp-usr--qrSqjQYkR8aqYSLQnuQmzA',
+    'pp-usr-000101-qrSqjQYkR8aqYSLQnuQm!A',
+    'pp-usr-000101-notauuid',
+    'pp-usr-000101-8d14e543-04de4644-9715-3f44a4088f98',
+    '000101-qrSqjQYkR8aqYSLQnuQmzA',
+])
+def test_parsed_id_invalid(some_id):
+    with pytest.raises(ValueError):
+        idm.ParsedId.parse(some_id)
+
+
+def test_parsed_id_pack_sorts():
+    id_gen = idm.id_generator('pp-usr', start_at=98)
+    ids = [idm.ParsedId.parse(i) for i in id_gen.generate_many(5)]
+    ids.append(idm.ParsedId.parse(id_gen("Vodafone")))
+    packed = [parsed.pack() for parsed in ids]
+    assert all(len(p) == 40 for p in packed)
+    assert sorted(packed) == [p.pack() for p in sorted(ids)]
+    assert [idm.ParsedId.unpack(p) for p in packed] == ids
+    with pytest.raises(ValueError):
+        ids[0].pack(prefix_width=4)
+
+
+@mark.parametrize('some_id, counter', [
+    ('pp-usr-000101-qrSqjQYkR8aqYSLQnuQmzA', 101),
+    ('pp-usr-johnsm-qrSqjQYkR8aqYSLQnuQmzA', -1),
+    ('pp-sec-3445-8d14e543-04de-4644-9715-3f44a4088f98', 3445),
+    ('pp-sec-3445-8d14e54304de464497153f44a4088f98', 3445),
+    ('rubbish', -1),
+])
+def test_get_id_counter(some_id, counter):
+    assert idm.get_id_counter(some_id) == counter
+
+
+@pytest.fixture
+def counter_store(tmpdir):
+    return idm.SQLiteCounterStore(str(tmpdir.join('counters.db')))
+
+
+def test_block_counter_leases_in_blocks(counter_store):
+    first = idm.BlockCounter(counter_store, 'pp-usr', start_at=101,
+                             block_size=10)
+    second = idm.BlockCounter(counter_store, 'pp-usr', start_at=101,
+                              block_size=10)
+    assert [first.next_number() for _ in range(3)] == [101, 102, 103]
+    assert second.next_number() == 111
+    assert [first.next_number() for _ in range(8)] == [
+        104, 105, 106, 107, 108, 109, 110, 121]
+
+
+def test_block_counter_skip_to(counter_store):
+    counter = idm.BlockCounter(counter_store, 'pp-usr', block_size=10)
+    assert counter.next_number() == 1
+    counter.skip_to(5)
+    assert counter.next_number() == 6
+    counter.skip_to(500)
+    assert counter.next_number() == 501
+    other = idm.BlockCounter(counter_store, 'pp-usr', block_size=10)
+    assert other.next_number() == 511
+
+
+def test_id_generator_with_store(counter_store):
+    id_gen_a = idm.id_generator('pp-usr', start_at=101, store=counter_store,
+                                block_size=100)
+    id_gen_b = idm.id_generator('pp-usr', start_at=101, store=counter_store,
+                                block_size=100)
+    assert id_gen_a(0).startswith('pp-usr-000101-')
+    assert id_gen_b(0).startswith('pp-usr-000201-')
+    assert id_gen_a(5001).startswith('pp-usr-005001-')
+    assert id_gen_a(0).startswith('pp-usr-005002-')
+    assert id_gen_a("John Smith").startswith('pp-usr-johnsm')
+    assert [i[:14] for i in id_gen_b.generate_many(2)] == ['pp-usr-000202-',
+                                                         'pp-usr-000203-']
+
+
+def _lease_numbers(args):
+    path, count = args
+    counter = idm.BlockCounter(idm.SQLiteCounterStore(path), 'pp-usr',
+                               block_size=7)
+    return [counter.next_number() for _ in range(count)]
+
+
+def test_block_counter_across_processes(tmpdir):
+    path = str(tmpdir.join('counters.db'))
+    idm.SQLiteCounterStore(path)
+    pool = multiprocessing.Pool(4)
+    try:
+        results = pool.map(_lease_numbers, [(path, 50)] * 8)
+    finally:
+        pool.close()
+        pool.join()
+    numbers = [number for result in results for number in result]
+    assert len(set(numbers)) == len(numbers) == 400
+
+
+def test_mapped_store_survives_restart(tmpdir):
+    path = str(tmpdir.join('counters.state'))
+    with idm.MappedCounterStore(path) as store:
+        id_gen = idm.id_generator('pp-usr', start_at=101, store=store,
+                                  block_size=10)
+        assert id_gen(0).startswith('pp-usr-000101-')
+        assert id_gen(0).startswith('pp-usr-000102-')
+    # A restart skips the rest of the leased block
+    with idm.MappedCounterStore(path) as store:
+        id_gen = idm.id_generator('pp-usr', start_at=101, store=store,
+                                  block_size=10)
+        assert id_gen(0).startswith('pp-usr-000111-')
+
+
+def test_mapped_store_prefixes(tmpdir):
+    with idm.MappedCounterStore(str(tmpdir.join('counters.state'))) as store:
+        assert store.lease('pp-usr', 10, start_at=101) == 101
+        assert store.lease('pp-sec', 10, start_at=5) == 5
+        assert store.lease('pp-usr', 10) == 111
+        assert store.lease('pp-sec', 10, at_least=100) == 100
+        assert store.lease('pp-sec', 10) == 110
+
+
+def test_mapped_store_create_keeps_existing(tmpdir):
+    path = str(tmpdir.join('counters.state'))
+    with idm.MappedCounterStore(path) as store:
+        assert store.lease('pp-usr', 10) == 1
+        size = os.path.getsize(path)
+        # As if another process found no file, then lost the race to make it
+        store._create(slots=8)
+        assert os.path.getsize(path) == size
+        assert store.lease('pp-usr', 10) == 11
+    assert tmpdir.listdir() == [tmpdir.join('counters.state')]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs os.fork")
+def test_mapped_store_after_fork(tmpdir):
+    path = str(tmpdir.join('counters.state'))
+    with idm.MappedCounterStore(path) as store:
+        assert store.lease('pp-usr', 10) == 1
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            try:
+                os._exit(0 if store.lease('pp-usr', 10) == 11 else 1)
+            except BaseException:
+                os._exit(2)
+        assert os.waitpid(pid, 0)[1] == 0
+        assert store.lease('pp-usr', 10) == 21
+
+
+def test_mapped_store_torn_write(tmpdir):
+    path = str(tmpdir.join('counters.state'))
+    with idm.MappedCounterStore(path) as store:
+        assert store.lease('pp-usr', 10) == 1
+        assert store.lease('pp-usr', 10) == 11
+    # Simulate a crash part way through writing the third lease, which
+    # goes to the older of the two records in the slot
+    offset = (store.HEADER.size + store.PREFIX_SIZE + store.RECORD.size)
+    with open(path, 'r+b') as state_file:
+        state_file.seek(offset + 4)
+        state_file.write(b'\xff\xff')
+    with idm.MappedCounterStore(path) as store:
+        assert store.lease('pp-usr', 10) == 21
+
+
 if __name__ == '__main__':
     print("Starting...\n")
 
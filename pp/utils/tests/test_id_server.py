@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/tests/test_id_server.py
+
+import asyncio
+import json
+
+import pytest
+
+from pp.utils.id_server import IdBlockServer, IdBlockClient, IdServerError
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def socket_path(tmpdir):
+    return str(tmpdir.join('ids.sock'))
+
+
+def test_clients_share_prefix_sequence(socket_path):
+    async def go():
+        server = IdBlockServer(socket_path, start_at=101)
+        await server.start()
+        try:
+            async with IdBlockClient(socket_path, 'pp-usr', block_size=10,
+                                     name='a') as client_a, \
+                    IdBlockClient(socket_path, 'pp-usr', block_size=10,
+                                  name='b') as client_b:
+                ids_a = await client_a.next_ids(25)
+                ids_b = await client_b.next_ids(25)
+                stats = await client_a.server_stats()
+                return ids_a, ids_b, client_a.stats(), stats
+        finally:
+            await server.close()
+
+    ids_a, ids_b, client_stats, server_stats = run(go())
+    ids = ids_a + ids_b
+    assert len(set(ids)) == 50
+    assert all(i.startswith('pp-usr-') and len(i) == 36 for i in ids)
+    counters = sorted(int(i.split('-')[2]) for i in ids)
+    assert counters[0] == 101
+    assert len(set(counters)) == 50
+    assert client_stats['fetches'] >= 3
+    assert client_stats['hits'] + client_stats['waits'] == 25
+    assert set(server_stats) == {'a', 'b'}
+    assert server_stats['a']['prefix'] == 'pp-usr'
+    assert server_stats['a']['ids'] == 10 * server_stats['a']['blocks']
+
+
+def test_client_prefetches_in_background(socket_path):
+    async def go():
+        server = IdBlockServer(socket_path)
+        await server.start()
+        try:
+            async with IdBlockClient(socket_path, 'pp-sec', block_size=20,
+                                     low_water=10) as client:
+                for _ in range(60):
+                    await client.next_id()
+                    # Let the background fetch run, as a real caller would
+                    await asyncio.sleep(0)
+                return client.stats()
+        finally:
+            await server.close()
+
+    stats = run(go())
+    assert stats['waits'] == 1
+    assert stats['hits'] == 59
+
+
+def test_server_rejects_bad_block(socket_path):
+    async def go():
+        server = IdBlockServer(socket_path, max_block=5)
+        await server.start()
+        try:
+            client = IdBlockClient(socket_path, 'pp-sec', block_size=50)
+            await client.connect()
+            try:
+                await client.next_id()
+            finally:
+                await client.close()
+        finally:
+            await server.close()
+
+    with pytest.raises(IdServerError):
+        run(go())
+
+
+@pytest.mark.parametrize('line', [b'[]', b'1', b'"x"', b'null', b'{'])
+def test_server_rejects_bad_request(socket_path, line):
+    async def go():
+        server = IdBlockServer(socket_path)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            try:
+                writer.write(line + b'\n')
+                await writer.drain()
+                error = json.loads(await reader.readline())
+                # The connection is still usable
+                writer.write(b'{"op": "block", "prefix": "pp-usr"}\n')
+                await writer.drain()
+                block = json.loads(await reader.readline())
+            finally:
+                writer.close()
+                await writer.wait_closed()
+            return error, block
+        finally:
+            await server.close()
+
+    error, block = run(go())
+    assert set(error) == {'error'}
+    assert len(block['ids']) == 1
+
+
+class FailingServer(IdBlockServer):
+    """Serves one block, then rejects every request."""
+    blocks = 0
+
+    def _block(self, request):
+        self.blocks += 1
+        if self.blocks > 1:
+            raise ValueError("out of IDs")
+        return super(FailingServer, self)._block(request)
+
+
+def test_client_raises_prefetch_error(socket_path):
+    async def go():
+        server = FailingServer(socket_path)
+        await server.start()
+        try:
+            async with IdBlockClient(socket_path, 'pp-usr', block_size=4,
+                                     low_water=2) as client:
+                ids = [await client.next_id() for _ in range(3)]
+                # Let the background fetch fail
+                for _ in range(10):
+                    await asyncio.sleep(0)
+                with pytest.raises(IdServerError):
+                    await client.next_id()
+                # The error is raised once, then fetching is retried
+                ids.append(await client.next_id())
+                with pytest.raises(IdServerError):
+                    await client.next_id()
+                return ids
+        finally:
+            await server.close()
+
+    assert len(set(run(go()))) == 4
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/tests/test_json_.py
+
+import enum
+import json
+import uuid
+import datetime
+
+import pytest
+from zope.interface import Interface, directlyProvides
+
+from pp.utils import json_
+from pp.utils.json_ import CustomEncoder, add_adapter
+
+
+class Plain(object):
+    x = 5
+
+
+class WithJSON(object):
+    def __json__(self):
+        return {'with': 'json'}
+
+
+class IThing(Interface):
+    pass
+
+
+def dumps(obj):
+    return json.dumps(obj, cls=CustomEncoder)
+
+
+def test_encode_datetime():
+    assert dumps([datetime.datetime(2013, 5, 30, 9, 30)] * 2) == \
+        '["2013-05-30T09:30:00", "2013-05-30T09:30:00"]'
+
+
+def test_encode_json_attribute():
+    assert dumps(WithJSON()) == '{"with": "json"}'
+    plain = Plain()
+    plain.__json__ = lambda: 'instance'
+    assert dumps(plain) == '"instance"'
+
+
+def test_unknown_type_raises_type_error():
+    with pytest.raises(TypeError) as error:
+        dumps(Plain())
+    with pytest.raises(TypeError) as expected:
+        json.dumps(Plain())
+    assert str(error.value) == str(expected.value)
+
+
+def test_add_adapter_clears_dispatch_cache():
+    class Later(object):
+        pass
+    with pytest.raises(TypeError):
+        dumps(Later())
+    assert json_._DISPATCH_CACHE[Later] is None
+    add_adapter(Later, lambda obj: 'later')
+    assert dumps(Later()) == '"later"'
+
+
+def test_instance_provided_interface():
+    add_adapter(IThing, lambda obj: 'thing')
+
+    class Provider(object):
+        pass
+    thing = Provider()
+    directlyProvides(thing, IThing)
+    assert dumps([thing]) == '["thing"]'
+    with pytest.raises(TypeError):
+        dumps(Provider())
+
+
+def records(n):
+    for index in range(n):
+        yield dict(index=index, at=datetime.datetime(2013, 5, 30, 9, 30),
+                   thing=WithJSON())
+
+
+@pytest.mark.parametrize('n', [0, 1, 3, 500])
+def test_iterencode_records_matches_dumps(n):
+    chunks = list(json_.iterencode_records(records(n), chunk_size=1000))
+    assert ''.join(chunks) == dumps(list(records(n)))
+    if n == 500:
+        assert len(chunks) > 10
+
+
+def test_iterencode_records_is_lazy():
+    read = []
+
+    def tracked():
+        for record in records(1000):
+            read.append(record)
+            yield record
+    chunks = json_.iterencode_records(tracked(), chunk_size=100)
+    next(chunks)
+    assert len(read) == 1
+
+
+def test_iterencode_records_separators():
+    text = ''.join(json_.iterencode_records(records(2),
+                                            separators=(',', ':')))
+    assert text == json.dumps(list(records(2)), cls=CustomEncoder,
+                              separators=(',', ':'))
+    with pytest.raises(ValueError):
+        list(json_.iterencode_records(records(2), indent=2))
+
+
+def test_dump_records_to_file_and_socket():
+    import io
+    import socket
+    out = io.StringIO()
+    assert json_.dump_records(records(20), out, chunk_size=50) == 20
+    assert out.getvalue() == dumps(list(records(20)))
+
+    sender, receiver = socket.socketpair()
+    try:
+        json_.dump_records(records(3), sender)
+        sender.close()
+        received = b''.join(iter(lambda: receiver.recv(4096), b''))
+    finally:
+        receiver.close()
+    assert received.decode('utf-8') == dumps(list(records(3)))
+
+
+class Adapted(object):
+    def __init__(self, value):
+        self.value = value
+
+add_adapter(Adapted, lambda obj: {'adapted': obj.value})
+
+
+class Color(enum.Enum):
+    RED = 'r'
+
+
+class Shade(enum.Enum):
+    DARK = 'd'
+
+    def __json__(self):
+        return self.name
+
+SAMPLE_UUID = uuid.UUID('aab4aa8d-0624-47c6-aa61-22d09ee426cc')
+
+CONFORMANCE_CASES = [
+    None,
+    [1, 2.5, "three", True, None],
+    {"unicode": u"café ☃", "slash": "a/b", "nested": {"a": [{}]}},
+    datetime.datetime(2013, 5, 30, 9, 30, 5, 123),
+    [datetime.datetime(2013, 5, 30)] * 3,
+    {"timeref": WithJSON(), "adapted": Adapted([1, 2])},
+    {1: "int key"},
+    2 ** 70,
+    [float('nan'), float('inf'), -float('inf')],
+    {"adapted": Adapted(float('nan'))},
+    [Shade.DARK],
+    {"adapted": Adapted(Shade.DARK)},
+    # Unadapted, so rejected by CustomEncoder
+    [Color.RED],
+    {"id": SAMPLE_UUID},
+    {"adapted": Adapted(SAMPLE_UUID)},
+]
+
+
+# Types orjson encodes itself, with adapters added only for these cases
+NATIVE_ADAPTERS = [
+    (Color, lambda obj: {'color': obj.name}),
+    (uuid.UUID, lambda obj: obj.hex),
+]
+NATIVE_CASES = [
+    [Color.RED],
+    {"id": SAMPLE_UUID},
+]
+
+
+@pytest.fixture
+def native_adapters():
+    for type_, adapter in NATIVE_ADAPTERS:
+        add_adapter(type_, adapter)
+    yield
+    for type_, _ in NATIVE_ADAPTERS:
+        assert json_.remove_adapter(type_)
+
+
+def normalised(encode, obj):
+    """ Return obj encoded and re-encoded, as NaN != NaN, or the TypeError
+        class if it can't be encoded.
+    """
+    try:
+        text = encode(obj)
+    except TypeError:
+        return TypeError
+    return json.dumps(json.loads(text), sort_keys=True)
+
+
+@pytest.fixture(params=json_.available_backends())
+def backend(request):
+    return json_.get_backend(request.param)
+
+
+@pytest.mark.parametrize('obj', CONFORMANCE_CASES)
+def test_backend_conformance(backend, obj):
+    assert normalised(backend.dumps, obj) == normalised(dumps, obj)
+
+
+@pytest.mark.parametrize('obj', CONFORMANCE_CASES + NATIVE_CASES)
+def test_backend_conformance_native_adapters(backend, native_adapters, obj):
+    assert normalised(backend.dumps, obj) == normalised(dumps, obj)
+
+
+def test_backend_native_adapters(backend, native_adapters):
+    assert json.loads(backend.dumps(NATIVE_CASES)) == [
+        [{'color': 'RED'}], {'id': SAMPLE_UUID.hex}]
+
+
+def test_remove_adapter():
+    class Thing(object):
+        pass
+    add_adapter(Thing, lambda obj: 'thing')
+    assert dumps([Thing()]) == '["thing"]'
+    assert json_.remove_adapter(Thing)
+    assert not json_.remove_adapter(Thing)
+    with pytest.raises(TypeError):
+        dumps([Thing()])
+
+
+def test_backend_unknown_type(backend):
+    with pytest.raises(TypeError):
+        backend.dumps({'plain': Plain()})
+    with pytest.raises(TypeError):
+        backend.dumps(datetime.date(2013, 5, 30))
+
+
+def test_backend_honours_new_datetime_adapter(backend):
+    class Stamp(datetime.datetime):
+        pass
+    add_adapter(Stamp, lambda obj: 'stamp')
+    assert json.loads(backend.dumps([Stamp(2013, 5, 30)])) == ['stamp']
+
+
+def test_get_backend():
+    assert 'json' in json_.available_backends()
+    assert json_.get_backend().name == json_.available_backends()[0]
+    assert json_.dumps([1], backend='json') == '[1]'
+    with pytest.raises(ValueError):
+        json_.get_backend('nope')
+
+
+def test_loads_timeref():
+    from pp.utils.timeref import DateRange
+    ranges = [DateRange('2013-05-30T09:30', '2013-05-31'),
+              DateRange('2012-01-01', '2012-02-01', interval=0)]
+    text = dumps({'ranges': ranges, 'other': {'timeref_type': 'unknown'}})
+    decoded = json_.loads(text)
+    assert decoded['ranges'] == ranges
+    assert isinstance(decoded['ranges'][0], DateRange)
+    assert decoded['other'] == {'timeref_type': 'unknown'}
+
+
+def test_loads_datetime_and_other_fields():
+    text = dumps([
+        {'created': datetime.datetime(2013, 5, 30, 9, 30), 'count': '3'},
+        {'created': None, 'name': 'created'},
+    ])
+    decoded = json_.loads(text, datetime_fields=['created'],
+                          fields={'count': int})
+    assert decoded == [
+        {'created': datetime.datetime(2013, 5, 30, 9, 30), 'count': 3},
+        {'created': None, 'name': 'created'},
+    ]
+
+
+def test_add_decoder():
+    json_.add_decoder('kind', lambda data: Adapted(data['value']), 'adapted')
+    try:
+        decoded = json_.loads('[{"kind": "adapted", "value": 5}, '
+                              '{"kind": "other", "value": 6}, '
+                              '{"kind": ["adapted"], "value": 7}]')
+        assert isinstance(decoded[0], Adapted)
+        assert decoded[0].value == 5
+        assert decoded[1] == {'kind': 'other', 'value': 6}
+        assert decoded[2] == {'kind': ['adapted'], 'value': 7}
+    finally:
+        json_.remove_decoder('kind', 'adapted')
+    assert 'kind' not in json_._DECODERS
+    decoded = json_.loads('{"kind": "adapted", "value": 5}')
+    assert decoded == {'kind': 'adapted', 'value': 5}
+
+
+@pytest.mark.parametrize('text', [
+    '{"timeref_type": ["x"]}',
+    '{"timeref_type": {}}',
+    '{"timeref_type": null}',
+])
+def test_unhashable_tag_value(text):
+    assert json_.loads(text) == json.loads(text)
+
+
+def ndjson_records(n):
+    from pp.utils.timeref import DateRange
+    for index in range(n):
+        yield dict(index=index,
+                   created=datetime.datetime(2013, 5, 30, 9, index % 60),
+                   slot=DateRange('2013-05-30T09:30', '2013-05-31'))
+
+
+@pytest.mark.parametrize('workers, chunk_size', [(1, 1000), (3, 7)])
+def test_ndjson_round_trip(workers, chunk_size):
+    import io
+    out = io.StringIO()
+    count = json_.dump_ndjson(ndjson_records(100), out, workers=workers,
+                              chunk_size=chunk_size)
+    assert count == 100
+    text = out.getvalue()
+    assert text == ''.join(dumps(record) + '\n'
+                           for record in ndjson_records(100))
+    loaded = list(json_.load_ndjson(io.StringIO(text + '\n'),
+                                    workers=workers, chunk_size=chunk_size,
+                                    datetime_fields=['created']))
+    assert loaded == list(ndjson_records(100))
+
+
+def test_ndjson_parallel_output_identical():
+    import io
+    serial, parallel = io.BytesIO(), io.BytesIO()
+    json_.dump_ndjson(ndjson_records(50), serial, encoding='utf-8')
+    json_.dump_ndjson(ndjson_records(50), parallel, workers=2, chunk_size=4,
+                      encoding='utf-8')
+    assert serial.getvalue() == parallel.getvalue()
+
+
+@json_.json_shape(['x', ('when', 'created'), 'items'], type_tag='shaped',
+                  converters=dict(when=json_.datetime_adapter))
+class Shaped(object):
+    def __init__(self, x):
+        self.x = x
+        self.created = datetime.datetime(2013, 5, 30, 9, 30)
+        self.items = [x, u"ü", None, True, 1.5, Adapted(x)]
+
+    def __json__(self):
+        return 'ignored, the shape takes precedence'
+
+
+def test_json_shape_to_json_and_text():
+    shaped = Shaped(5)
+    expected = {'type': 'shaped', 'x': 5, 'when': '2013-05-30T09:30:00',
+                'items': [5, u"ü", None, True, 1.5, {'adapted': 5}]}
+    assert json.loads(dumps(shaped)) == expected
+    shape = json_._SHAPES[Shaped]
+    assert shape.to_json(shaped) == dict(expected, items=shaped.items)
+    assert shape.to_text(shaped) == json.dumps(expected)
+    assert shape.encode_many([Shaped(1), Shaped(2)]) == dumps(
+        [Shaped(1), Shaped(2)])
+
+
+def test_json_shape_streaming():
+    import io
+    objs = [Shaped(index) for index in range(5)]
+    assert ''.join(json_.iterencode_records(objs)) == dumps(objs)
+    out = io.StringIO()
+    json_.dump_ndjson(objs, out)
+    assert out.getvalue() == ''.join(dumps(obj) + '\n' for obj in objs)
+
+
+def test_json_shape_invalid_attribute():
+    with pytest.raises(ValueError):
+        json_.JSONShape(['x; import os'])
+
+
+def test_daterange_shape_matches_json_method():
+    from pp.utils.timeref import DateRange
+    daterange = DateRange('2013-05-30T09:30', '2013-05-31', interval=2)
+    assert dumps(daterange) == json.dumps(daterange.__json__())
+    assert ''.join(json_.iterencode_records([daterange])) == \
+        json.dumps([daterange.__json__()])
+
+
+@pytest.mark.parametrize('value', [
+    datetime.datetime(2013, 8, 14),
+    datetime.datetime(2013, 8, 14, 18, 5, 1),
+    datetime.datetime(2013, 8, 14, 18, 5, 1, 25),
+    datetime.datetime(2013, 8, 14, 18, 5, 1, 250000),
+    datetime.date(2013, 8, 14),
+])
+def test_parse_iso_datetime_isoformat(value):
+    from dateutil.parser import parse
+    text = value.isoformat()
+    assert json_.parse_iso_datetime(text) == parse(text)
+
+
+@pytest.mark.parametrize('text', [
+    '2013-08-14T18:05:01+05:30',
+    '2013-08-14T18:05:01.123-02:00',
+    '2013-08-14T18:05:01+00:00',
+    '2013-08-14T18:05:01Z',
+    '2013-08-14 18:05',
+])
+def test_parse_iso_datetime_offsets(text):
+    from dateutil.parser import parse
+    parsed = json_.parse_iso_datetime(text)
+    expected = parse(text)
+    assert parsed == expected
+    assert parsed.utcoffset() == expected.utcoffset()
+
+
+def test_parse_datetime_falls_back():
+    assert json_.parse_iso_datetime('14 Aug 2013') is None
+    assert json_.parse_datetime('14 Aug 2013') == datetime.datetime(
+        2013, 8, 14)
+    assert json_.parse_datetime('20130814') == datetime.datetime(2013, 8, 14)
+    with pytest.raises(ValueError):
+        json_.parse_datetime('2013-13-14')
+
+
+def test_parse_datetime_cache():
+    cache = json_.set_datetime_cache(2)
+    try:
+        for text in ['2013-08-14', '2013-08-14', '2013-08-15']:
+            json_.parse_datetime(text)
+        assert cache.stats() == dict(hits=1, misses=2, size=2, maxsize=2)
+    finally:
+        assert json_.set_datetime_cache(None) is None
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/tests/test_phonetic_index.py
+
+import pytest
+
+from pp.utils.phonetic_index import PhoneticIndex
+
+
+@pytest.fixture
+def index():
+    index = PhoneticIndex()
+    index.insert('c1', "Vodafone Group Plc")
+    index.insert('c2', "Lloyds Bank Ltd")
+    index.insert('c3', "Bank of America Corp")
+    index.insert('c4', "Microsoft Corporation")
+    return index
+
+
+def test_candidates_share_tokens(index):
+    assert index.candidates("Vodaphone") == [('c1', 1)]
+    assert index.candidates("Loyds Bank") == [('c2', 2), ('c3', 1)]
+    assert index.candidates("Apple Inc") == []
+
+
+def test_candidates_rerank(index):
+    for rerank in ('jaro_winkler', 'levenshtein'):
+        ranked = index.candidates("Bank of Amerika", rerank=rerank)
+        assert [key for key, _ in ranked] == ['c3', 'c2']
+        assert ranked[0][1] > ranked[1][1]
+    assert index.candidates("Loyds Bank", rerank='levenshtein',
+                            limit=1)[0][0] == 'c2'
+    with pytest.raises(ValueError):
+        index.candidates("Loyds Bank", rerank='soundex')
+
+
+def test_insert_replaces_and_remove(index):
+    index.insert('c1', "Apple Inc")
+    assert index.candidates("Vodaphone") == []
+    assert index.candidates("Apple") == [('c1', 1)]
+    index.remove('c2')
+    assert 'c2' not in index
+    assert index.candidates("Loyds Bank") == [('c3', 1)]
+    assert len(index) == 3
+    assert index.bucket_sizes()['BNK'] == 1
+    with pytest.raises(KeyError):
+        index.remove('c2')
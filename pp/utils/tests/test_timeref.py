@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
-from datetime import datetime
+import json
+import pickle
+from datetime import datetime, timedelta
 
 from dateutil.parser import parse as dt
 import pytest
 
-from pp.utils.timeref import DateRange, RepeatingTimeReference
+from pp.utils import json_
+from pp.utils.timeref import (DateRange, RepeatingTimeReference,
+                              PointInTime, Duration, CompactDateRange,
+                              CLOSED_CLOSED, CLOSED_OPEN, OPEN_CLOSED,
+                              OPEN_OPEN, KEY_MIN, KEY_MAX, epoch_us,
+                              from_epoch_us, point_key, bin_array)
 
 
 def test_daterange_dict_from_range():
@@ -18,6 +25,20 @@ def test_daterange_dict_from_range():
     assert tr['timeref_type'] == 'daterange'
 
 
+@pytest.mark.parametrize('start, end', [
+    ("2012-10-01T09:30:05", None),
+    (None, "2012-10-01T10:20:05"),
+    (None, None),
+])
+def test_daterange_json_open_ended(start, end):
+    tr = DateRange.dict_from_range(start=start, end=end, interval=OPEN_OPEN)
+    assert tr == dict(timeref_type='daterange', interval=OPEN_OPEN,
+                      start=start, end=end)
+    date_range = DateRange(start, end, OPEN_OPEN)
+    assert date_range.__json__() == json.loads(json_.dumps(date_range))
+    assert DateRange.fromJSON(tr) == date_range
+
+
 def test_daterange_constructor_empty():
     dr = DateRange()
     assert dr.start is None
@@ -83,3 +104,175 @@ def test_repeating_end_after_repeat():
     assert rr.next_after(dt("2013-01-01 09:19")) == dt("2013-01-01 09:20")
     assert rr.next_after(dt("2013-01-01 09:20")) is None
     assert rr.next_after(dt("2013-01-01 09:21")) is None
+
+
+@pytest.mark.parametrize(('interval', 'expected'), [
+    (CLOSED_CLOSED, [False, True, True, True, False]),
+    (CLOSED_OPEN, [False, True, True, False, False]),
+    (OPEN_CLOSED, [False, False, True, True, False]),
+    (OPEN_OPEN, [False, False, True, False, False]),
+])
+def test_daterange_match_keys(interval, expected):
+    dr = DateRange('20130101', '20130103', interval)
+    low, high = dr.bound_keys()
+    points = [dt('20121231'), dt('20130101'), dt('20130102'),
+              dt('20130103'), dt('20130104')]
+    assert [dr.match(p) for p in points] == expected
+    assert [low <= point_key(p) <= high for p in points] == expected
+
+
+def test_daterange_match_open_ended():
+    assert DateRange(None, '20130101').match(dt('19000101'))
+    assert DateRange('20130101', None).match(dt('21000101'))
+    assert DateRange().bound_keys() == (KEY_MIN, KEY_MAX)
+
+
+def test_epoch_us_aware():
+    assert epoch_us(dt('1970-01-01T01:00:00+01:00')) == 0
+    assert epoch_us(datetime(1970, 1, 1, 0, 0, 1, 5)) == 1000005
+    assert from_epoch_us(1000005) == datetime(1970, 1, 1, 0, 0, 1, 5)
+
+
+@pytest.mark.parametrize('interval', [CLOSED_CLOSED, CLOSED_OPEN,
+                                      OPEN_CLOSED, OPEN_OPEN])
+@pytest.mark.parametrize(('start', 'end'), [
+    ('2013-01-01T10:00:00', '2013-01-01T10:00:02'),
+    ('2013-01-01T10:00:00.5', '2013-01-01T10:00:01.5'),
+    (None, '2013-01-01T10:00:01'),
+    ('2013-01-01T10:00:01', None),
+    (None, None),
+])
+def test_daterange_match_array(interval, start, end):
+    np = pytest.importorskip('numpy')
+    dr = DateRange(start, end, interval)
+    points = [dt('2013-01-01T10:00:00') + timedelta(milliseconds=250 * n)
+              for n in range(-4, 16)]
+    expected = [dr.match(p) for p in points]
+    ts = np.array(points, dtype='datetime64[ms]')
+    assert dr.match_array(ts).tolist() == expected
+    assert dr.match_array(ts.astype('datetime64[ns]')).tolist() == expected
+    assert dr.match_array(ts.view('int64'), unit='ms').tolist() == expected
+    seconds = ts.astype('datetime64[s]')
+    assert dr.match_array(seconds.view('int64'), unit='s').tolist() == [
+        dr.match(p.replace(microsecond=0)) for p in points]
+
+
+def test_daterange_match_array_nat():
+    np = pytest.importorskip('numpy')
+    ts = np.array(['2013-01-01', 'NaT'], dtype='datetime64[D]')
+    assert DateRange().match_array(ts).tolist() == [True, False]
+
+
+def test_bin_array():
+    np = pytest.importorskip('numpy')
+    ranges = [DateRange('2013-01-03', '2013-01-05'),
+              DateRange(None, '2013-01-02', CLOSED_CLOSED),
+              DateRange('2013-01-06', None, OPEN_OPEN)]
+    ts = np.arange('2012-12-31', '2013-01-09', dtype='datetime64[D]')
+    bins = bin_array(ranges, ts)
+    assert bins.tolist() == [1, 1, 1, 0, 0, -1, -1, 2, 2]
+    assert bin_array(ranges, ts.view('int64'), unit='D').tolist() == \
+        bins.tolist()
+    assert bin_array([], ts).tolist() == [-1] * 9
+    with pytest.raises(ValueError):
+        bin_array(ranges + [DateRange('2013-01-04', '2013-01-07')], ts)
+
+
+def test_repeating_next_after_keeps_microseconds():
+    rr = RepeatingTimeReference(dt("2013-01-01 09:00:00.5"), 10)
+    assert rr.next_after(dt("2013-01-01 09:10:00.5")) == \
+        dt("2013-01-01 09:20:00.5")
+
+
+def test_repeating_next_after_end_after_time():
+    rr = RepeatingTimeReference(start=dt("2013-01-01 09:00"),
+                                frequency=10,
+                                end_after_time=dt("2013-01-01 09:25"))
+    assert rr.next_after(dt("2013-01-01 09:15")) == dt("2013-01-01 09:20")
+    assert rr.next_after(dt("2013-01-01 09:20")) is None
+
+
+@pytest.mark.parametrize(('kwargs', 'start', 'end', 'expected'), [
+    (dict(end_after_repeat=2), None, None, ['09:00', '09:10', '09:20']),
+    (dict(end_after_time=dt("2013-01-01 09:20")), None, None,
+     ['09:00', '09:10', '09:20']),
+    (dict(), dt("2013-01-01 09:05"), dt("2013-01-01 09:30"),
+     ['09:10', '09:20']),
+    (dict(), dt("2013-01-01 09:10"), dt("2013-01-01 09:10"), []),
+    (dict(end_after_repeat=5), dt("2012-12-31"), dt("2013-01-01 09:15"),
+     ['09:00', '09:10']),
+    (dict(end_after_repeat=1), dt("2013-01-01 09:30"), None, []),
+])
+def test_repeating_occurrences(kwargs, start, end, expected):
+    np = pytest.importorskip('numpy')
+    rr = RepeatingTimeReference(dt("2013-01-01 09:00"), 10, **kwargs)
+    expected = [dt("2013-01-01 " + t) for t in expected]
+    assert list(rr.occurrences(start, end)) == expected
+    assert rr.occurrences_array(start, end).tolist() == expected
+    assert rr.occurrences_array(start, end).dtype == np.dtype('M8[us]')
+
+
+def test_repeating_occurrences_unbounded():
+    rr = RepeatingTimeReference(dt("2013-01-01 09:00"), 60)
+    occurrences = rr.occurrences(dt("2013-01-02"))
+    assert next(occurrences) == dt("2013-01-02 00:00")
+    assert next(occurrences) == dt("2013-01-02 01:00")
+    with pytest.raises(ValueError):
+        rr.occurrences_array()
+
+
+@pytest.mark.parametrize('timeref', [
+    PointInTime('2013-08-14'),
+    Duration(minutes=5),
+    RepeatingTimeReference(dt('2013-08-14'), 10),
+    DateRange('2013-08-14', '2013-08-15'),
+    CompactDateRange('2013-08-14', '2013-08-15'),
+])
+def test_timeref_slots(timeref):
+    assert not hasattr(timeref, '__dict__')
+    with pytest.raises(AttributeError):
+        timeref.unknown = 1
+
+
+@pytest.mark.parametrize('interval', [CLOSED_CLOSED, CLOSED_OPEN,
+                                      OPEN_CLOSED, OPEN_OPEN])
+@pytest.mark.parametrize(('start', 'end'), [
+    ('2013-01-01T10:00:00.000001', '2013-01-01T10:00:02'),
+    (None, '2013-01-01T10:00:01'),
+    ('1969-12-31T23:59:59', None),
+    (None, None),
+])
+def test_compact_daterange_same_as_daterange(interval, start, end):
+    compact = CompactDateRange(start, end, interval)
+    plain = DateRange(start, end, interval)
+    assert (compact.start, compact.end) == (plain.start, plain.end)
+    assert compact == plain
+    assert compact.bound_keys() == plain.bound_keys()
+    points = [dt('2013-01-01T10:00:00') + timedelta(microseconds=500000 * n)
+              for n in range(-2, 7)] + [dt('1969-12-31T23:59:59')]
+    assert [compact.match(p) for p in points] == \
+        [plain.match(p) for p in points]
+    assert pickle.loads(pickle.dumps(compact)) == compact
+    assert json.loads(json_.dumps(compact)) == json.loads(json_.dumps(plain))
+
+
+@pytest.mark.parametrize('start, end', [
+    ('2013-08-14T10:00:00.5', '2013-08-14T10:00:00'),
+    ('2013-08-14T10:00:30', '2013-08-14T10:00:00'),
+    ('2013-08-14T10:00:00', '2013-08-14T10:01:59.9'),
+    ('2013-08-14T10:00:00', '2013-08-14T09:58:00.1'),
+])
+def test_compact_daterange_minutes_truncate(start, end):
+    plain = DateRange(start, end)
+    assert CompactDateRange(start, end).minutes == plain.minutes
+
+
+def test_compact_daterange_from_json():
+    data = DateRange.dict_from_range('2013-08-14', '2013-08-15')
+    compact = CompactDateRange.fromJSON(data)
+    assert isinstance(compact, CompactDateRange)
+    assert compact.bounds_us() == (epoch_us(dt('2013-08-14')),
+                                   epoch_us(dt('2013-08-15')))
+    assert compact.minutes == 60 * 24
+    assert CompactDateRange.from_epoch_us(0, None).start == \
+        datetime(1970, 1, 1)
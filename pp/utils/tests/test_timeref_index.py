@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/tests/test_timeref_index.py
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from pp.utils.timeref import (DateRange, CLOSED_CLOSED, CLOSED_OPEN,
+                              OPEN_CLOSED, OPEN_OPEN)
+from pp.utils.timeref_index import DateRangeIndex, overlap_join
+
+BASE = datetime(2013, 8, 14)
+
+
+def hours(n):
+    return BASE + timedelta(hours=n)
+
+
+def random_ranges(count, seed=1):
+    rand = random.Random(seed)
+    ranges = []
+    for _ in range(count):
+        start = rand.randint(0, 100)
+        end = start + rand.randint(0, 10)
+        ranges.append(DateRange(
+            None if rand.random() < 0.05 else hours(start),
+            None if rand.random() < 0.05 else hours(end),
+            rand.choice([CLOSED_CLOSED, CLOSED_OPEN, OPEN_CLOSED, OPEN_OPEN])))
+    return ranges
+
+
+def snapped_keys(date_range):
+    # Bound keys at whole microseconds, as ranges only overlap if a
+    # datetime lies in both
+    low, high = date_range.bound_keys()
+    return low + (low & 1), high - (high & 1)
+
+
+def brute_overlapping(ranges, start, end, interval):
+    low, high = snapped_keys(DateRange(start, end, interval))
+    if low > high:
+        # An empty query
+        return []
+    found = []
+    for date_range in ranges:
+        range_low, range_high = snapped_keys(date_range)
+        if range_low <= high and low <= range_high and range_low <= range_high:
+            found.append(date_range)
+    return found
+
+
+def test_empty_index():
+    index = DateRangeIndex([])
+    assert len(index) == 0
+    assert index.containing(BASE) == []
+    assert index.overlapping(BASE, hours(1)) == []
+
+
+@pytest.mark.parametrize(('interval', 'at_start', 'at_end'), [
+    (CLOSED_CLOSED, True, True),
+    (CLOSED_OPEN, True, False),
+    (OPEN_CLOSED, False, True),
+    (OPEN_OPEN, False, False),
+])
+def test_containing_respects_interval(interval, at_start, at_end):
+    date_range = DateRange(hours(1), hours(2), interval)
+    index = DateRangeIndex([date_range])
+    assert bool(index.containing(hours(1))) is at_start
+    assert bool(index.containing(hours(2))) is at_end
+    assert index.containing(hours(1.5)) == [date_range]
+    assert index.containing(hours(3)) == []
+
+
+def test_containing_open_ended():
+    before = DateRange(None, hours(1))
+    after = DateRange(hours(1), None)
+    index = DateRangeIndex([after, before])
+    assert index.containing(datetime(1900, 1, 1)) == [before]
+    assert index.containing(hours(1)) == [after]
+    assert index.containing(datetime(2100, 1, 1)) == [after]
+
+
+def test_overlapping_touching_bounds():
+    index = DateRangeIndex([DateRange(hours(0), hours(1), CLOSED_OPEN),
+                            DateRange(hours(0), hours(1), CLOSED_CLOSED)])
+    found = index.overlapping(hours(1), hours(2))
+    assert [r.interval for r in found] == [CLOSED_CLOSED]
+
+
+@pytest.mark.parametrize(('start', 'end', 'interval'), [
+    (hours(1), hours(1), CLOSED_OPEN),
+    (hours(1), hours(1), OPEN_OPEN),
+    (hours(18), hours(6), CLOSED_OPEN),
+    (hours(18), hours(6), CLOSED_CLOSED),
+    (hours(1) - timedelta(microseconds=1), hours(1), OPEN_OPEN),
+])
+def test_overlapping_empty_query(start, end, interval):
+    index = DateRangeIndex([DateRange(hours(0), hours(24)),
+                            DateRange(None, None)])
+    assert index.overlapping(start, end, interval) == []
+    assert index.overlapping_range(DateRange(start, end, interval)) == []
+
+
+def test_overlapping_between_microseconds():
+    # No datetime lies in both [0, 1h) and (1h - 1us, 2h)
+    before = DateRange(hours(0), hours(1), CLOSED_OPEN)
+    index = DateRangeIndex([before])
+    after_start = hours(1) - timedelta(microseconds=1)
+    assert index.overlapping(after_start, hours(2), OPEN_OPEN) == []
+    assert index.overlapping(after_start, hours(2), CLOSED_OPEN) == [before]
+    after = DateRange(after_start, hours(2), OPEN_OPEN)
+    assert list(overlap_join([before], [after])) == []
+    assert list(overlap_join([before], [after], intersections=True)) == []
+
+
+def test_matches_brute_force():
+    ranges = random_ranges(500)
+    index = DateRangeIndex(ranges)
+    for n in range(-2, 115):
+        dt = hours(n / 2.0)
+        assert index.containing(dt) == [r for r in index if r.match(dt)]
+    rand = random.Random(2)
+    for _ in range(200):
+        start = hours(rand.randint(0, 110))
+        end = start + timedelta(hours=rand.randint(0, 5))
+        interval = rand.choice([CLOSED_CLOSED, CLOSED_OPEN, OPEN_OPEN])
+        assert (index.overlapping(start, end, interval) ==
+                brute_overlapping(list(index), start, end, interval))
+    assert (index.overlapping_range(DateRange(None, hours(3))) ==
+            brute_overlapping(list(index), None, hours(3), CLOSED_OPEN))
+
+
+def brute_join(left, right):
+    # Empty ranges, like (a, a), overlap nothing
+    left = [(a, snapped_keys(a)) for a in left]
+    right = [(b, snapped_keys(b)) for b in right]
+    left = [(a, keys) for a, keys in left if keys[0] <= keys[1]]
+    right = [(b, keys) for b, keys in right if keys[0] <= keys[1]]
+    return [(a, b) for a, a_keys in left for b, b_keys in right
+            if a_keys[0] <= b_keys[1] and b_keys[0] <= a_keys[1]]
+
+
+def pair_ids(pairs):
+    return sorted((id(a), id(b)) for a, b in pairs)
+
+
+def test_overlap_join_matches_brute_force():
+    left = random_ranges(300, seed=3)
+    right = random_ranges(200, seed=4)
+    pairs = list(overlap_join(left, right))
+    assert pair_ids(pairs) == pair_ids(brute_join(left, right))
+    assert list(overlap_join(left, [])) == []
+
+
+def test_overlap_join_touching_bounds():
+    closed = DateRange(hours(0), hours(1), CLOSED_CLOSED)
+    half_open = DateRange(hours(0), hours(1), CLOSED_OPEN)
+    after = DateRange(hours(1), hours(2), CLOSED_OPEN)
+    open_after = DateRange(hours(1), hours(2), OPEN_OPEN)
+    pairs = list(overlap_join([closed, half_open], [after, open_after]))
+    assert pairs == [(closed, after)]
+
+
+def test_overlap_join_intersections():
+    left = random_ranges(100, seed=5)
+    right = random_ranges(100, seed=6)
+    pairs = list(overlap_join(left, right))
+    found = list(overlap_join(left, right, intersections=True))
+    assert len(found) == len(pairs)
+    for (a, b), both in zip(pairs, found):
+        for n in range(-2, 230):
+            dt = hours(n / 2.0)
+            assert both.match(dt) == (a.match(dt) and b.match(dt))
+
+
+def test_overlap_join_intersection_bounds():
+    [both] = overlap_join([DateRange(hours(0), hours(3), OPEN_CLOSED)],
+                          [DateRange(None, hours(2), CLOSED_OPEN)],
+                          intersections=True)
+    assert both == DateRange(hours(0), hours(2), OPEN_OPEN)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/tests/test_timeref_schedule.py
+import random
+from datetime import datetime, timedelta
+
+from pp.utils.timeref import RepeatingTimeReference
+from pp.utils.timeref_schedule import Scheduler
+
+BASE = datetime(2013, 8, 14)
+
+
+def minutes(n):
+    return BASE + timedelta(minutes=n)
+
+
+def test_empty():
+    schedule = Scheduler()
+    assert len(schedule) == 0
+    assert schedule.peek() is None
+    assert schedule.pop_due(minutes(100)) == []
+
+
+def test_pop_due_in_time_order():
+    schedule = Scheduler()
+    schedule.add('a', RepeatingTimeReference(minutes(0), 10))
+    schedule.add('b', RepeatingTimeReference(minutes(5), 15))
+    assert schedule.peek() == (minutes(0), 'a')
+    # Occurrences at the same time may come in any order
+    assert sorted(schedule.pop_due(minutes(20))) == [
+        (minutes(0), 'a'), (minutes(5), 'b'), (minutes(10), 'a'),
+        (minutes(20), 'a'), (minutes(20), 'b')]
+    assert schedule.peek() == (minutes(30), 'a')
+    assert schedule.pop_due(minutes(29)) == []
+
+
+def test_series_end():
+    schedule = Scheduler()
+    schedule.add('repeat', RepeatingTimeReference(minutes(0), 10,
+                                                  end_after_repeat=2))
+    schedule.add('time', RepeatingTimeReference(
+        minutes(0), 10, end_after_time=minutes(15)))
+    due = schedule.pop_due(minutes(100))
+    assert [when for when, key in due if key == 'repeat'] == [
+        minutes(0), minutes(10), minutes(20)]
+    assert [when for when, key in due if key == 'time'] == [
+        minutes(0), minutes(10)]
+    assert len(schedule) == 0
+    assert schedule.peek() is None
+
+
+def test_add_after_and_remove():
+    schedule = Scheduler()
+    series = RepeatingTimeReference(minutes(0), 10)
+    assert schedule.add('a', series, after=minutes(15)) == minutes(20)
+    assert schedule.add('b', RepeatingTimeReference(minutes(0), 7),
+                        after=minutes(15)) == minutes(21)
+    assert 'a' in schedule
+    assert schedule.remove('a') is series
+    assert schedule.remove('a') is None
+    assert 'a' not in schedule
+    assert schedule.peek() == (minutes(21), 'b')
+    # Replacing a series drops its old entry
+    schedule.add('b', RepeatingTimeReference(minutes(0), 60))
+    assert schedule.pop_due(minutes(61)) == [(minutes(0), 'b'),
+                                             (minutes(60), 'b')]
+    assert schedule.add('c', RepeatingTimeReference(
+        minutes(0), 10, end_after_repeat=1), after=minutes(11)) is None
+    assert 'c' not in schedule
+
+
+def test_remove_compacts_heap():
+    schedule = Scheduler()
+    for key in range(10):
+        schedule.add(key, RepeatingTimeReference(minutes(key), 60))
+    # Replacing and removing series, without popping, leaves the heap
+    # at most twice the number of live series
+    for n in range(1000):
+        schedule.add(n % 10, RepeatingTimeReference(minutes(n), 60))
+        assert len(schedule._heap) <= 2 * len(schedule) + 1
+    for key in range(9):
+        schedule.remove(key)
+    assert len(schedule._heap) <= 3
+    assert schedule.peek() == (minutes(999), 9)
+    assert schedule.pop_due(minutes(999)) == [(minutes(999), 9)]
+
+
+def test_matches_next_after():
+    rand = random.Random(1)
+    schedule = Scheduler()
+    series = {}
+    for key in range(50):
+        series[key] = RepeatingTimeReference(
+            minutes(rand.randint(0, 60)), rand.randint(1, 30),
+            end_after_repeat=rand.choice([None, 3, 10]))
+        schedule.add(key, series[key])
+    tick = timedelta(microseconds=1)
+    last = BASE - tick
+    while last < minutes(300):
+        now = last + timedelta(minutes=rand.randint(1, 20))
+        # Occurrences after the last tick, up to and including now
+        expected = sorted(
+            (when, key) for key, one in series.items()
+            for when in one.occurrences(last + tick, now + tick))
+        due = schedule.pop_due(now)
+        assert [when for when, _ in due] == sorted(when for when, _ in due)
+        assert sorted(due) == expected
+        last = now
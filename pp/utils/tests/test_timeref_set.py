@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/tests/test_timeref_set.py
+import json
+import random
+from datetime import datetime, timedelta
+
+from dateutil.parser import parse as dt
+from dateutil.tz import tzoffset
+import pytest
+
+from pp.utils.timeref import (DateRange, CLOSED_CLOSED, CLOSED_OPEN,
+                              OPEN_CLOSED, OPEN_OPEN)
+from pp.utils.timeref_set import DateRangeSet
+
+BASE = datetime(2013, 8, 14)
+INTERVALS = [CLOSED_CLOSED, CLOSED_OPEN, OPEN_CLOSED, OPEN_OPEN]
+
+
+def hours(n):
+    return BASE + timedelta(hours=n)
+
+
+def random_ranges(count, seed):
+    rand = random.Random(seed)
+    ranges = []
+    for _ in range(count):
+        start = rand.randint(0, 40)
+        ranges.append(DateRange(
+            None if rand.random() < 0.05 else hours(start),
+            None if rand.random() < 0.05 else hours(
+                start + rand.randint(0, 4)),
+            rand.choice(INTERVALS)))
+    return ranges
+
+
+# Half hours, so points inside and on the bounds of ranges are all tested
+POINTS = [hours(n / 2.0) for n in range(-4, 100)]
+
+
+def test_normalise_coalesces():
+    drs = DateRangeSet([DateRange(hours(2), hours(3)),
+                        DateRange(hours(0), hours(1), CLOSED_OPEN),
+                        DateRange(hours(1), hours(2), CLOSED_OPEN),
+                        DateRange(hours(5), hours(6), OPEN_OPEN),
+                        DateRange(hours(6), hours(7), OPEN_OPEN)])
+    assert drs.to_ranges() == [
+        DateRange(hours(0), hours(3), CLOSED_OPEN),
+        DateRange(hours(5), hours(6), OPEN_OPEN),
+        DateRange(hours(6), hours(7), OPEN_OPEN),
+    ]
+    assert drs.minutes == 300
+
+
+def test_open_and_closed_touching_bounds():
+    drs = DateRangeSet([DateRange(hours(0), hours(1), CLOSED_CLOSED),
+                        DateRange(hours(1), hours(2), OPEN_OPEN)])
+    assert drs.to_ranges() == [DateRange(hours(0), hours(2), CLOSED_OPEN)]
+
+
+def test_empty_ranges_dropped():
+    drs = DateRangeSet([DateRange(hours(1), hours(1), CLOSED_OPEN),
+                        DateRange(hours(2), hours(1))])
+    assert len(drs) == 0
+    assert drs.minutes == 0
+    assert hours(1) not in drs
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_algebra_matches_points(seed):
+    a_ranges = random_ranges(20, seed)
+    b_ranges = random_ranges(20, seed + 100)
+    a, b = DateRangeSet(a_ranges), DateRangeSet(b_ranges)
+
+    def in_a(p):
+        return any(r.match(p) for r in a_ranges)
+
+    def in_b(p):
+        return any(r.match(p) for r in b_ranges)
+
+    for p in POINTS:
+        assert a.match(p) == in_a(p)
+        assert (a | b).match(p) == (in_a(p) or in_b(p))
+        assert (a & b).match(p) == (in_a(p) and in_b(p))
+        assert (a - b).match(p) == (in_a(p) and not in_b(p))
+        assert (~a).match(p) == (not in_a(p))
+        assert any(r.match(p) for r in a) == in_a(p)
+    assert a | b == b | a
+    assert a & b == b & a
+    assert ~~a == a
+    assert (a - b) | (a & b) == a
+
+
+def test_covers():
+    drs = DateRangeSet([DateRange(hours(0), hours(2), CLOSED_OPEN),
+                        DateRange(hours(3), None)])
+    assert drs.covers(hours(0), hours(2))
+    assert not drs.covers(hours(0), hours(2), CLOSED_CLOSED)
+    assert not drs.covers(hours(1), hours(4))
+    assert drs.covers(hours(3), None)
+    assert not drs.covers(None, hours(1))
+
+
+def test_minutes_unbounded():
+    with pytest.raises(ValueError):
+        DateRangeSet([DateRange(hours(0), None)]).minutes
+
+
+def test_json_round_trip():
+    drs = DateRangeSet([DateRange(None, hours(1), OPEN_OPEN),
+                        DateRange(hours(2), hours(3), OPEN_CLOSED)])
+    data = json.loads(json.dumps(drs.__json__()))
+    # A missing bound is neither open nor closed, so comes back closed
+    assert data[0] == dict(timeref_type='daterange', interval=CLOSED_OPEN,
+                           start=None, end='2013-08-14T01:00:00')
+    assert DateRangeSet.fromJSON(data) == drs
+
+
+def test_aware_ranges_keep_timezone():
+    tz = tzoffset(None, 3600)
+    drs = DateRangeSet([DateRange(dt('2013-08-14T10:00+01:00'),
+                                  dt('2013-08-14T11:00+01:00'))])
+    [date_range] = drs.to_ranges()
+    assert date_range.start == dt('2013-08-14T09:00Z')
+    assert date_range.start.utcoffset() == tz.utcoffset(None)
+    assert drs.match(dt('2013-08-14T09:30Z'))
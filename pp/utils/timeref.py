@@ -5,16 +5,150 @@ Created on Oct 18, 2012
 
 @author: eeaston
 '''
-import time
 from datetime import timedelta, datetime
 
-import dateutil.parser
+from pp.utils.json_ import JSONShape, parse_datetime
 
 CLOSED_CLOSED = 0
 CLOSED_OPEN = 1
 OPEN_CLOSED = 2
 OPEN_OPEN = 3
 
+# Interval bits: an open start, an open end
+_OPEN_START = OPEN_CLOSED
+_OPEN_END = CLOSED_OPEN
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Keys for missing range bounds, see range_keys
+KEY_MIN = -2 ** 63
+KEY_MAX = 2 ** 63 - 1
+
+
+def epoch_us(dt):
+    """ Microseconds since 1970-01-01, as an int.
+
+    Aware datetimes are converted to UTC; naive ones are taken as UTC.
+    """
+    offset = dt.utcoffset()
+    if offset is not None:
+        dt = dt.replace(tzinfo=None) - offset
+    return _delta_us(dt - _EPOCH)
+
+
+def _delta_us(delta):
+    """ Microseconds in a timedelta, as an int.
+    """
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_epoch_us(us):
+    """ Naive datetime for microseconds since 1970-01-01.
+    """
+    return _EPOCH + timedelta(microseconds=us)
+
+
+def point_key(dt):
+    """ Integer key for a datetime, comparable with range_keys.
+    """
+    return 2 * epoch_us(dt)
+
+
+def range_keys(start, end, interval=CLOSED_OPEN):
+    """ Return (low, high) integer keys for a range, such that a datetime
+    dt is in the range exactly when low <= point_key(dt) <= high.
+
+    Keys are twice the epoch microseconds, plus one above a bound open at
+    the start or less one below a bound open at the end, so open and
+    closed bounds order correctly. A missing bound is KEY_MIN or KEY_MAX.
+
+    Open bounds fall half a microsecond inside the range, between the
+    keys of datetimes. So low <= high does not mean a datetime lies in
+    the range: (t - 1us, t) has low == high, but is empty. Likewise,
+    ranges whose keys overlap may share no datetime. To compare ranges
+    at microsecond resolution, round an odd low key up and an odd high
+    key down first.
+    """
+    if start is None:
+        low = KEY_MIN
+    else:
+        low = 2 * epoch_us(start) + (1 if interval & _OPEN_START else 0)
+    if end is None:
+        high = KEY_MAX
+    else:
+        high = 2 * epoch_us(end) - (1 if interval & _OPEN_END else 0)
+    return low, high
+
+
+# Microseconds in each NumPy datetime unit, as (numerator, denominator)
+_UNIT_US = {
+    'W': (7 * 86400000000, 1),
+    'D': (86400000000, 1),
+    'h': (3600000000, 1),
+    'm': (60000000, 1),
+    's': (1000000, 1),
+    'ms': (1000, 1),
+    'us': (1, 1),
+    'ns': (1, 1000),
+}
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+
+def _epoch_array(ts, unit):
+    """ Return ts as an int64 array of epoch values, its (numerator,
+    denominator) of microseconds per value, and a mask of its NaT values
+    or None.
+    """
+    import numpy as np
+    ts = np.asarray(ts)
+    if ts.dtype.kind == 'M':
+        unit, count = np.datetime_data(ts.dtype)
+        values = ts.view(np.int64)
+        nat = np.isnat(ts)
+        if not nat.any():
+            nat = None
+    else:
+        count = 1
+        values = ts.astype(np.int64, copy=False)
+        nat = None
+    try:
+        numerator, denominator = _UNIT_US[unit]
+    except KeyError:
+        raise ValueError("Unsupported unit {!r}".format(unit))
+    return values, (numerator * count, denominator), nat
+
+
+def _array_bounds(start, end, interval, scale):
+    """ Return inclusive (low, high) epoch values of a range, in units of
+    scale (numerator, denominator) microseconds, or None if no value can
+    match. Either may be None for a missing bound.
+    """
+    numerator, denominator = scale
+    low = high = None
+    if start is not None:
+        scaled = epoch_us(start) * denominator
+        if interval & _OPEN_START:
+            low = scaled // numerator + 1
+        else:
+            low = -(-scaled // numerator)
+    if end is not None:
+        scaled = epoch_us(end) * denominator
+        if interval & _OPEN_END:
+            high = -(-scaled // numerator) - 1
+        else:
+            high = scaled // numerator
+    if ((low is not None and low > _INT64_MAX) or
+            (high is not None and high < _INT64_MIN) or
+            (low is not None and high is not None and low > high)):
+        return None
+    if low is not None and low <= _INT64_MIN:
+        low = None
+    if high is not None and high >= _INT64_MAX:
+        high = None
+    return low, high
+
 
 class TimeReference(object):
     """ Represents a piece of data referring to date or time
@@ -39,7 +173,7 @@ class TimeReference(object):
         if thing:
             if isinstance(thing, datetime):
                 return thing
-            return dateutil.parser.parse(thing)
+            return parse_datetime(thing)
         return None
 
     @classmethod
@@ -48,14 +182,18 @@ class TimeReference(object):
         """
         return SERIALISE_CLASS_LOOKUP[data['timeref_type']].fromJSON(data)
 
+    __slots__ = ()
+
 
 class PointInTime(TimeReference):
     def __init__(self, point):
         self.point = self.dt(point)
 
+    __slots__ = ['point']
+
 
 class FuzzyTimeReference(TimeReference):
-    pass
+    __slots__ = ()
 
 
 class Duration(TimeReference):
@@ -66,6 +204,8 @@ class Duration(TimeReference):
             (minutes or 0)
         )
 
+    __slots__ = ['minutes']
+
 
 class RepeatingTimeReference(TimeReference):
     def __init__(self, start, frequency,
@@ -88,6 +228,37 @@ class RepeatingTimeReference(TimeReference):
         self.end_after_time = end_after_time
         self.end_after_repeat = end_after_repeat
 
+    def _frequency_us(self):
+        return int(round(self.frequency * 60000000))
+
+    def _last_index(self):
+        """ Index of the last occurrence (the start is 0), or None if the
+        series does not end.
+        """
+        last = self.end_after_repeat or None
+        if self.end_after_time:
+            by_time = (_delta_us(self.end_after_time - self.start) //
+                       self._frequency_us())
+            if last is None or by_time < last:
+                last = by_time
+        return last
+
+    def _index_bounds(self, start, end):
+        """ Return (first, stop) indexes of the occurrences from start up
+        to but not including end. stop is None for no end.
+        """
+        frequency = self._frequency_us()
+        first = 0
+        if start is not None and start > self.start:
+            first = -(-_delta_us(start - self.start) // frequency)
+        last = self._last_index()
+        stop = None if last is None else last + 1
+        if end is not None:
+            by_end = -(-_delta_us(end - self.start) // frequency)
+            if stop is None or by_end < stop:
+                stop = by_end
+        return first, stop
+
     def next_after(self, dt):
         """ Returns the next recurrence of the series after a given datetime
 
@@ -100,21 +271,51 @@ class RepeatingTimeReference(TimeReference):
 
             [start_date .... r0 ...... r1 ...... rn-1 .. dt .. rn]
                              [ f = freq ]                       ^
-            [ ---- s = seconds since seq start ----------]      |
-                                                 [ s % f ]      |
+            [ ---- s = microseconds since seq start -----]      |
                                                                 |
-                                                       rn = dt + f - (s % f)
+                                                 rn = start + (s // f + 1) f
+
+        Returns None if the series ends before rn.
         """
         if dt < self.start:
             return self.start
-        if self.end_after_time and dt > self.end_after_time:
-            return None
-        f = self.frequency * 60
-        s = (time.mktime(dt.timetuple()) -
-             time.mktime(self.start.timetuple()))
-        if self.end_after_repeat and (s - s % f) / f >= self.end_after_repeat:
+        frequency = self._frequency_us()
+        index = _delta_us(dt - self.start) // frequency + 1
+        last = self._last_index()
+        if last is not None and index > last:
             return None
-        return dt + timedelta(seconds=f - s % f)
+        return self.start + timedelta(microseconds=index * frequency)
+
+    def occurrences(self, start=None, end=None):
+        """ Generate the recurrences of the series from start up to but not
+        including end, in order.
+
+        Either may be None for the series start or end. For a series with
+        no end_after_time or end_after_repeat and no end, this does not
+        stop.
+        """
+        frequency = self._frequency_us()
+        index, stop = self._index_bounds(start, end)
+        while stop is None or index < stop:
+            yield self.start + timedelta(microseconds=index * frequency)
+            index += 1
+
+    def occurrences_array(self, start=None, end=None):
+        """ Return the recurrences from start up to but not including end
+        as a NumPy datetime64[us] array (in UTC, for an aware series start).
+
+        Raises ValueError if neither end nor the series give an end.
+        """
+        import numpy as np
+        first, stop = self._index_bounds(start, end)
+        if stop is None:
+            raise ValueError("The series does not end, so give an end")
+        frequency = self._frequency_us()
+        indexes = np.arange(first, max(first, stop), dtype=np.int64)
+        return (np.datetime64(epoch_us(self.start), 'us') +
+                (indexes * frequency).astype('timedelta64[us]'))
+
+    __slots__ = ['start', 'frequency', 'end_after_time', 'end_after_repeat']
 
 
 # TODO: think about relative dates (datutil.relativedelta)
@@ -154,14 +355,7 @@ class DateRange(TimeReference):
             }
 
         """
-        # start = self.start.isoformat() if self.start else None
-        # end = self.end.isoformat() if self.end else None
-        return dict(
-            timeref_type="daterange",
-            interval=self.interval,
-            start=self.start.isoformat(),
-            end=self.end.isoformat(),
-        )
+        return _DATE_RANGE_SHAPE.to_json(self)
 
     @classmethod
     def fromJSON(cls, data):
@@ -193,21 +387,220 @@ class DateRange(TimeReference):
     def match(self, dt):
         """ True if this datetime is contained within this date range
         """
-        logic_map = {
-            CLOSED_CLOSED: ((self.start is None or dt >= self.start) and
-                            (self.end is None or dt <= self.end)),
-            CLOSED_OPEN: ((self.start is None or dt >= self.start) and
-                          (self.end is None or dt < self.end)),
-            OPEN_CLOSED: ((self.start is None or dt > self.start) and
-                          (self.end is None or dt <= self.end)),
-            OPEN_OPEN: ((self.start is None or dt > self.start) and
-                        (self.end is None or dt < self.end)),
-        }
-        return logic_map[self.interval]
+        start = self.start
+        if start is not None and (dt < start or (
+                dt == start and self.interval & _OPEN_START)):
+            return False
+        end = self.end
+        if end is not None and (dt > end or (
+                dt == end and self.interval & _OPEN_END)):
+            return False
+        return True
+
+    def bound_keys(self):
+        """ Return the (low, high) integer keys of this range, see range_keys
+        """
+        return range_keys(self.start, self.end, self.interval)
+
+    def match_array(self, ts, unit='us'):
+        """ Boolean mask of the timestamps contained in this date range.
+
+        Parameters
+        ----------
+        ts: `numpy.ndarray`
+            datetime64 array (any unit; NaT never matches), or integers
+            since 1970-01-01 UTC
+        unit: `str`
+            Unit of integer timestamps: 'D', 'h', 'm', 's', 'ms', 'us'
+            or 'ns'. Ignored for datetime64 arrays.
+        """
+        import numpy as np
+        values, scale, nat = _epoch_array(ts, unit)
+        bounds = _array_bounds(self.start, self.end, self.interval, scale)
+        if bounds is None:
+            return np.zeros(values.shape, dtype=bool)
+        low, high = bounds
+        if low is None and high is None:
+            mask = np.ones(values.shape, dtype=bool)
+        elif high is None:
+            mask = values >= low
+        elif low is None:
+            mask = values <= high
+        else:
+            mask = (values >= low) & (values <= high)
+        if nat is not None:
+            mask &= ~nat
+        return mask
 
     __slots__ = ['start', 'end', 'interval']
 
 
+# DateRange's own storage for start and end, which CompactDateRange uses
+# for epoch microseconds
+_START_SLOT = DateRange.start
+_END_SLOT = DateRange.end
+
+# Epoch microseconds of datetimes in years 1 to 9999 are within
+# +/- 2 ** 58, so with this offset two fit in one 118 bit int
+_PACK_OFFSET = 2 ** 58
+_PACK_SHIFT = 59
+_PACK_MASK = 2 ** 59 - 1
+# Stored as the end, when the start holds both bounds
+_PACKED = object()
+
+
+class CompactDateRange(DateRange):
+    """
+    Date range storing its bounds as epoch microseconds, making datetimes
+    only when start or end are read. A range with both bounds holds them
+    in a single int.
+
+    Aware datetimes are stored as UTC, and read back as naive UTC.
+    """
+    def __init__(self, start=None, end=None, interval=CLOSED_OPEN):
+        start = self.dt(start)
+        end = self.dt(end)
+        self._set_bounds_us(None if start is None else epoch_us(start),
+                            None if end is None else epoch_us(end))
+        self.interval = interval
+
+    @classmethod
+    def from_epoch_us(cls, start_us=None, end_us=None, interval=CLOSED_OPEN):
+        """ Make a range from epoch microseconds, or None for no bound.
+        """
+        result = cls.__new__(cls)
+        result._set_bounds_us(start_us, end_us)
+        result.interval = interval
+        return result
+
+    def _set_bounds_us(self, start_us, end_us):
+        if start_us is None or end_us is None:
+            _START_SLOT.__set__(self, start_us)
+            _END_SLOT.__set__(self, end_us)
+        else:
+            _START_SLOT.__set__(self, (
+                (start_us + _PACK_OFFSET) << _PACK_SHIFT |
+                end_us + _PACK_OFFSET))
+            _END_SLOT.__set__(self, _PACKED)
+
+    def bounds_us(self):
+        """ Return (start, end) as epoch microseconds, or None for no bound.
+        """
+        start = _START_SLOT.__get__(self)
+        end = _END_SLOT.__get__(self)
+        if end is _PACKED:
+            return ((start >> _PACK_SHIFT) - _PACK_OFFSET,
+                    (start & _PACK_MASK) - _PACK_OFFSET)
+        return start, end
+
+    def __reduce__(self):
+        return (_compact_date_range, self.bounds_us() + (self.interval,))
+
+    @property
+    def start(self):
+        us = self.bounds_us()[0]
+        return None if us is None else from_epoch_us(us)
+
+    @property
+    def end(self):
+        us = self.bounds_us()[1]
+        return None if us is None else from_epoch_us(us)
+
+    @property
+    def minutes(self):
+        """
+        Number of full minutes in this date range
+        """
+        start, end = self.bounds_us()
+        # Truncated to whole seconds, towards zero, as DateRange does
+        return int((end - start) / 1e6) / 60
+
+    def match(self, dt):
+        """ True if this datetime is contained within this date range
+        """
+        us = epoch_us(dt)
+        start, end = self.bounds_us()
+        if start is not None and (us < start or (
+                us == start and self.interval & _OPEN_START)):
+            return False
+        if end is not None and (us > end or (
+                us == end and self.interval & _OPEN_END)):
+            return False
+        return True
+
+    def bound_keys(self):
+        """ Return the (low, high) integer keys of this range, see range_keys
+        """
+        start, end = self.bounds_us()
+        low = KEY_MIN if start is None else (
+            2 * start + (1 if self.interval & _OPEN_START else 0))
+        high = KEY_MAX if end is None else (
+            2 * end - (1 if self.interval & _OPEN_END else 0))
+        return low, high
+
+    __slots__ = ()
+
+
+def _compact_date_range(start_us, end_us, interval):
+    # Unpickle a CompactDateRange
+    return CompactDateRange.from_epoch_us(start_us, end_us, interval)
+
+
+def bin_array(ranges, ts, unit='us'):
+    """ Find the DateRange containing each timestamp.
+
+    ranges are DateRanges that do not overlap, in any order, and ts and
+    unit are as for DateRange.match_array. Returns an int64 array of the
+    position in ranges of the one containing each timestamp, or -1.
+    Raises ValueError if any ranges overlap.
+
+    e.g. to pick the timestamps in any range and the range of each::
+
+        bins = bin_array(ranges, ts)
+        found = bins >= 0
+        ts[found], bins[found]
+    """
+    import numpy as np
+    values, scale, nat = _epoch_array(ts, unit)
+    lows, highs, positions = [], [], []
+    for position, date_range in enumerate(ranges):
+        bounds = _array_bounds(date_range.start, date_range.end,
+                               date_range.interval, scale)
+        if bounds is not None:
+            lows.append(_INT64_MIN if bounds[0] is None else bounds[0])
+            highs.append(_INT64_MAX if bounds[1] is None else bounds[1])
+            positions.append(position)
+    if not positions:
+        return np.full(values.shape, -1, dtype=np.int64)
+    lows = np.array(lows, dtype=np.int64)
+    highs = np.array(highs, dtype=np.int64)
+    positions = np.array(positions, dtype=np.int64)
+    order = np.argsort(lows, kind='stable')
+    lows, highs, positions = lows[order], highs[order], positions[order]
+    if (lows[1:] <= highs[:-1]).any():
+        raise ValueError("DateRanges overlap")
+    found = np.searchsorted(lows, values, side='right') - 1
+    clipped = np.maximum(found, 0)
+    inside = (found >= 0) & (values <= highs[clipped])
+    if nat is not None:
+        inside &= ~nat
+    return np.where(inside, positions[clipped], -1)
+
+
+def _isoformat(dt):
+    return dt.isoformat() if dt is not None else None
+
+# The JSON form of DateRange, also returned by DateRange.__json__
+_DATE_RANGE_SHAPE = JSONShape(
+    ['interval', 'start', 'end'],
+    type_tag='daterange',
+    tag_field='timeref_type',
+    converters=dict(start=_isoformat, end=_isoformat),
+)
+_DATE_RANGE_SHAPE.register(DateRange)
+_DATE_RANGE_SHAPE.register(CompactDateRange)
+
+
 SERIALISE_CLASS_LOOKUP = {
     'daterange': DateRange,
 }
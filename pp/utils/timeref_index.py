@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/timeref_index.py
+"""
+Index over many DateRanges, to find those containing a datetime or
+overlapping another range without testing each one, and a join of the
+overlapping ranges of two collections.
+
+The ranges are sorted by start and kept as an implicit balanced binary
+tree, each node of which records the highest end in its subtree, so a
+query only visits the subtrees that can hold a match: O(min(n, k log n))
+for k results. Bounds are compared as integer keys (see
+timeref.range_keys), which respect each range's interval kind and missing
+(None) bounds, moved in to whole microseconds, so ranges only overlap if
+a datetime lies in both.
+
+e.g.
+    index = DateRangeIndex(ranges)
+    index.containing(datetime(2013, 8, 14, 18))
+    index.overlapping(datetime(2013, 8, 14), datetime(2013, 8, 15))
+
+    for booking, window in overlap_join(bookings, windows):
+        ...
+"""
+from pp.utils.timeref import (DateRange, CLOSED_CLOSED, CLOSED_OPEN,
+                              OPEN_CLOSED, point_key, range_keys)
+
+
+def _snapped(low, high):
+    """ Keys low and high moved in to the nearest point keys, so that the
+    keys overlap only where a datetime lies in both ranges.
+    """
+    return low + (low & 1), high - (high & 1)
+
+
+class DateRangeIndex(object):
+    """ Static index of DateRanges. Datetimes in the ranges and queries
+    should be all naive or all timezone-aware.
+    """
+    def __init__(self, ranges):
+        keyed = sorted(((_snapped(*date_range.bound_keys()), position,
+                         date_range)
+                        for position, date_range in enumerate(ranges)),
+                       key=lambda item: (item[0][0], item[1]))
+        self.ranges = [date_range for _, _, date_range in keyed]
+        self.lows = [keys[0] for keys, _, _ in keyed]
+        self.highs = [keys[1] for keys, _, _ in keyed]
+        # Highest high key of the subtree rooted at each position
+        self.max_highs = list(self.highs)
+        self._build(0, len(self.ranges))
+
+    def _build(self, lo, hi):
+        """ Fill in max_highs for the subtree of positions lo to hi - 1,
+        returning its highest key.
+        """
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        highest = self.highs[mid]
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > highest:
+                highest = child
+        self.max_highs[mid] = highest
+        return highest
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def _search(self, low, high):
+        """ Positions of the ranges overlapping keys low to high, in order.
+        """
+        if low > high:
+            # An empty query range overlaps nothing
+            return []
+        lows, highs, max_highs = self.lows, self.highs, self.max_highs
+        found = []
+        # Subtrees as (lo, hi) bounds, or (position, None) for a match,
+        # pushed so they pop in position order
+        stack = [(0, len(lows))]
+        while stack:
+            lo, hi = stack.pop()
+            if hi is None:
+                found.append(lo)
+                continue
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if max_highs[mid] < low:
+                # Everything in this subtree ends too soon
+                continue
+            if lows[mid] <= high:
+                # Otherwise mid, and all after it, start too late
+                stack.append((mid + 1, hi))
+                if highs[mid] >= low and lows[mid] <= highs[mid]:
+                    stack.append((mid, None))
+            stack.append((lo, mid))
+        return found
+
+    def containing(self, dt):
+        """ Return the ranges containing datetime dt, ordered by start.
+        """
+        key = point_key(dt)
+        return [self.ranges[i] for i in self._search(key, key)]
+
+    def overlapping(self, start, end, interval=CLOSED_OPEN):
+        """ Return the ranges overlapping start to end, ordered by start.
+
+        The query range is half-open by default; either bound may be None.
+        """
+        low, high = _snapped(*range_keys(start, end, interval))
+        return [self.ranges[i] for i in self._search(low, high)]
+
+    def overlapping_range(self, date_range):
+        """ Return the ranges overlapping another DateRange.
+        """
+        low, high = _snapped(*date_range.bound_keys())
+        return [self.ranges[i] for i in self._search(low, high)]
+
+
+def _keyed(ranges):
+    """ Return (low, high, range) for the non-empty ranges, by low key.
+    """
+    keyed = []
+    for date_range in ranges:
+        low, high = _snapped(*date_range.bound_keys())
+        if low <= high:
+            keyed.append((low, high, date_range))
+    keyed.sort(key=lambda item: item[0])
+    return keyed
+
+
+def _intersection(first, second):
+    """ DateRange of the times in both overlapping ranges.
+    """
+    first_low, first_high = first.bound_keys()
+    second_low, second_high = second.bound_keys()
+    starts = first if first_low >= second_low else second
+    ends = first if first_high <= second_high else second
+    interval = CLOSED_CLOSED
+    if starts.start is not None and starts.interval & OPEN_CLOSED:
+        interval |= OPEN_CLOSED
+    if ends.end is not None and ends.interval & CLOSED_OPEN:
+        interval |= CLOSED_OPEN
+    return DateRange(starts.start, ends.end, interval)
+
+
+def overlap_join(left, right, intersections=False):
+    """ Generate a (left range, right range) pair for every range in left
+    that overlaps one in right, or the DateRange of their intersection
+    if intersections is True.
+
+    Both sides are sorted by start and swept together, keeping the
+    ranges of each side that are still open, so this takes
+    O((n + m) log(n + m) + k) for k pairs. Pairs come in order of the
+    later start of the two.
+    """
+    left, right = _keyed(left), _keyed(right)
+    # Ranges of each side started so far, and perhaps not yet ended
+    active_left, active_right = [], []
+    i = j = 0
+    while i < len(left) or j < len(right):
+        if j >= len(right) or (i < len(left) and left[i][0] <= right[j][0]):
+            low, high, current = left[i]
+            i += 1
+            active_left.append((high, current))
+            active_right[:] = [item for item in active_right
+                               if item[0] >= low]
+            for _, other in active_right:
+                if intersections:
+                    yield _intersection(current, other)
+                else:
+                    yield current, other
+        else:
+            low, high, current = right[j]
+            j += 1
+            active_right.append((high, current))
+            active_left[:] = [item for item in active_left
+                              if item[0] >= low]
+            for _, other in active_left:
+                if intersections:
+                    yield _intersection(other, current)
+                else:
+                    yield other, current
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/timeref_schedule.py
+"""
+Scheduler over many RepeatingTimeReference series, finding which fire
+next without asking every series.
+
+Each series has one entry in a heap, keyed on its next occurrence. Only
+series that come due are moved on to their next occurrence, so a tick
+costs O(log n) per occurrence fired, rather than O(n). Removed series
+are marked and dropped when they reach the top of the heap, or all at
+once when they outnumber the live entries.
+
+e.g.
+    schedule = Scheduler()
+    schedule.add('backup', RepeatingTimeReference(start, 60))
+    schedule.add('report', RepeatingTimeReference(start, 15,
+                                                  end_after_repeat=3))
+    for when, key in schedule.pop_due(datetime.utcnow()):
+        run(key)
+"""
+import heapq
+import itertools
+
+
+class Scheduler(object):
+    """ Priority queue of keyed RepeatingTimeReference series.
+    """
+    def __init__(self):
+        self._heap = []
+        # key -> its live heap entry, [when, order, key, series]
+        self._entries = {}
+        # Breaks ties between equal times, in the order added
+        self._order = itertools.count()
+        # Removed entries still in the heap
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _push(self, key, series, when):
+        if when is None:
+            # The series has ended
+            return
+        entry = [when, next(self._order), key, series]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+
+    def add(self, key, series, after=None):
+        """ Schedule series under key, from its first occurrence at or
+        after after (by default, the series start). A series already
+        under key is replaced. Returns the time it is next due, or None
+        if it has no occurrences left.
+        """
+        self.remove(key)
+        when = next(series.occurrences(after), None)
+        self._push(key, series, when)
+        return when
+
+    def remove(self, key):
+        """ Unschedule the series under key, returning it, or None.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        series = entry[3]
+        # Left in the heap, but no longer live
+        entry[2] = entry[3] = None
+        self._dead += 1
+        if self._dead > len(self._entries):
+            self._compact()
+        return series
+
+    def _compact(self):
+        """ Rebuild the heap from the live entries only.
+        """
+        self._heap = [entry for entry in self._heap if entry[3] is not None]
+        heapq.heapify(self._heap)
+        self._dead = 0
+
+    def _top(self):
+        heap = self._heap
+        while heap and heap[0][3] is None:
+            heapq.heappop(heap)
+            self._dead -= 1
+        return heap[0] if heap else None
+
+    def peek(self):
+        """ Return (when, key) of the next occurrence due, or None.
+        """
+        entry = self._top()
+        return None if entry is None else (entry[0], entry[2])
+
+    def pop_due(self, now):
+        """ Return (when, key) for every occurrence up to and including
+        now, in time order, moving each series on to its next occurrence.
+        Series that have ended are unscheduled.
+        """
+        due = []
+        while True:
+            entry = self._top()
+            if entry is None or entry[0] > now:
+                return due
+            when, _, key, series = entry
+            due.append((when, key))
+            del self._entries[key]
+            heapq.heappop(self._heap)
+            self._push(key, series, series.next_after(when))
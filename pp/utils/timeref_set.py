@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+# pp-utils/pp/utils/timeref_set.py
+"""
+Sets of date ranges held as arrays, with set algebra by linear merges.
+
+A DateRangeSet holds its ranges normalised: sorted, with overlapping or
+touching ranges coalesced. Each range is stored as its low and high
+integer keys (see timeref.range_keys) in two array('q') columns. A key
+is twice the epoch microseconds of a bound, and its lowest bit records
+whether the bound is open, so the interval flags need no column of
+their own, and bounds compare correctly whatever their interval kinds.
+
+e.g.
+    free = DateRangeSet([DateRange('2013-08-14T09:00', '2013-08-14T17:00')])
+    busy = DateRangeSet([DateRange('2013-08-14T12:00', '2013-08-14T13:00')])
+    (free - busy).to_ranges()
+    --> [<DateRange 2013-08-14 09:00:00--2013-08-14 12:00:00>,
+         <DateRange 2013-08-14 13:00:00--2013-08-14 17:00:00>]
+"""
+from array import array
+from bisect import bisect_right
+
+from pp.utils.timeref import (DateRange, CLOSED_CLOSED, OPEN_CLOSED,
+                              CLOSED_OPEN, KEY_MIN, KEY_MAX, from_epoch_us,
+                              point_key, range_keys)
+
+
+def _utc():
+    from dateutil.tz import tzutc
+    return tzutc()
+
+
+def _coalesce(pairs):
+    """ Return lows and highs lists for (low, high) pairs, sorted by low,
+    with empty ranges dropped and overlapping or touching ones joined.
+    """
+    lows, highs = [], []
+    for low, high in pairs:
+        if low > high:
+            continue
+        if highs and low <= highs[-1] + 1:
+            if high > highs[-1]:
+                highs[-1] = high
+        else:
+            lows.append(low)
+            highs.append(high)
+    return lows, highs
+
+
+def _merge(lows_a, highs_a, lows_b, highs_b):
+    """ Generate the (low, high) pairs of two sorted columns, by low.
+    """
+    i = j = 0
+    count_a, count_b = len(lows_a), len(lows_b)
+    while i < count_a and j < count_b:
+        if lows_a[i] <= lows_b[j]:
+            yield lows_a[i], highs_a[i]
+            i += 1
+        else:
+            yield lows_b[j], highs_b[j]
+            j += 1
+    while i < count_a:
+        yield lows_a[i], highs_a[i]
+        i += 1
+    while j < count_b:
+        yield lows_b[j], highs_b[j]
+        j += 1
+
+
+class DateRangeSet(object):
+    """ Normalised set of DateRanges, stored as sorted key columns.
+
+    Datetimes in the ranges should be all naive or all timezone-aware.
+    Aware ranges are returned in the timezone of the first bound given.
+    """
+    def __init__(self, ranges=(), tzinfo=None):
+        ranges = list(ranges)
+        if tzinfo is None:
+            for date_range in ranges:
+                bound = date_range.start or date_range.end
+                if bound is not None:
+                    tzinfo = bound.tzinfo
+                    break
+        self.tzinfo = tzinfo
+        lows, highs = _coalesce(sorted(
+            date_range.bound_keys() for date_range in ranges))
+        self.lows = array('q', lows)
+        self.highs = array('q', highs)
+
+    @classmethod
+    def _from_keys(cls, lows, highs, tzinfo=None):
+        """ Make a set from lists of keys, already normalised.
+        """
+        result = cls.__new__(cls)
+        result.tzinfo = tzinfo
+        result.lows = array('q', lows)
+        result.highs = array('q', highs)
+        return result
+
+    def __len__(self):
+        return len(self.lows)
+
+    def __iter__(self):
+        return iter(self.to_ranges())
+
+    def __eq__(self, other):
+        return (isinstance(other, DateRangeSet) and
+                self.lows == other.lows and self.highs == other.highs)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<DateRangeSet of {} ranges>".format(len(self))
+
+    # --------------------------------------------------------------------
+    # Conversion
+    # --------------------------------------------------------------------
+
+    def _datetime(self, us):
+        result = from_epoch_us(us)
+        if self.tzinfo is not None:
+            result = result.replace(tzinfo=_utc()).astimezone(self.tzinfo)
+        return result
+
+    def _range(self, low, high):
+        start = end = None
+        interval = CLOSED_CLOSED
+        if low != KEY_MIN:
+            start = self._datetime(low >> 1)
+            if low & 1:
+                interval |= OPEN_CLOSED
+        if high != KEY_MAX:
+            end = self._datetime((high + 1) >> 1)
+            if high & 1:
+                interval |= CLOSED_OPEN
+        return DateRange(start, end, interval)
+
+    def to_ranges(self):
+        """ Return the set as a list of DateRanges, in order.
+        """
+        return [self._range(low, high)
+                for low, high in zip(self.lows, self.highs)]
+
+    def __json__(self, request=None):
+        """ Return the set as a list of DateRange JSON dicts.
+        """
+        return [date_range.__json__() for date_range in self.to_ranges()]
+
+    @classmethod
+    def fromJSON(cls, data):
+        """ Make a set from a list of DateRange JSON dicts.
+        """
+        return cls(DateRange.fromJSON(item) for item in data)
+
+    # --------------------------------------------------------------------
+    # Queries
+    # --------------------------------------------------------------------
+
+    def match(self, dt):
+        """ True if a range in the set contains this datetime
+        """
+        key = point_key(dt)
+        i = bisect_right(self.lows, key) - 1
+        return i >= 0 and key <= self.highs[i]
+
+    __contains__ = match
+
+    def covers(self, start, end, interval=CLOSED_OPEN):
+        """ True if one range in the set contains all of start to end.
+        Either may be None.
+        """
+        low, high = range_keys(start, end, interval)
+        if low > high:
+            return True
+        i = bisect_right(self.lows, low) - 1
+        return i >= 0 and high <= self.highs[i]
+
+    @property
+    def minutes(self):
+        """
+        Number of full minutes in all the ranges of this set
+        """
+        if len(self) and (self.lows[0] == KEY_MIN or
+                          self.highs[-1] == KEY_MAX):
+            raise ValueError("DateRangeSet is unbounded")
+        total = sum(((high + 1) >> 1) - (low >> 1)
+                    for low, high in zip(self.lows, self.highs))
+        return (total // 1000000) / 60
+
+    # --------------------------------------------------------------------
+    # Set algebra
+    # --------------------------------------------------------------------
+
+    def union(self, other):
+        """ Return the set of times in either set.
+        """
+        lows, highs = _coalesce(_merge(self.lows, self.highs,
+                                       other.lows, other.highs))
+        return self._from_keys(lows, highs, self.tzinfo)
+
+    def intersection(self, other):
+        """ Return the set of times in both sets.
+        """
+        lows, highs = [], []
+        i = j = 0
+        lows_a, highs_a, lows_b, highs_b = (self.lows, self.highs,
+                                            other.lows, other.highs)
+        while i < len(lows_a) and j < len(lows_b):
+            low = max(lows_a[i], lows_b[j])
+            high = min(highs_a[i], highs_b[j])
+            if low <= high:
+                lows.append(low)
+                highs.append(high)
+            if highs_a[i] < highs_b[j]:
+                i += 1
+            else:
+                j += 1
+        return self._from_keys(lows, highs, self.tzinfo)
+
+    def complement(self):
+        """ Return the set of all times not in this set.
+        """
+        lows, highs = [], []
+        low = KEY_MIN
+        for range_low, range_high in zip(self.lows, self.highs):
+            if range_low != KEY_MIN:
+                lows.append(low)
+                highs.append(range_low - 1)
+            low = range_high + 1
+        if not len(self) or self.highs[-1] != KEY_MAX:
+            lows.append(low)
+            highs.append(KEY_MAX)
+        return self._from_keys(lows, highs, self.tzinfo)
+
+    def difference(self, other):
+        """ Return the set of times in this set but not the other.
+        """
+        return self.intersection(other.complement())
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __invert__ = complement